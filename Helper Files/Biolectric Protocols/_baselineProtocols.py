@@ -3,10 +3,17 @@
 # ------------------------- Imported Modules --------------------------------#
 
 # Basic modules
+import time
 import scipy
+from concurrent.futures import ProcessPoolExecutor
+import scipy.linalg
+import scipy.sparse
+import scipy.special
 import numpy as np
 # Baseline subtraction
 from BaselineRemoval import BaselineRemoval
+# Filtering
+import _filteringProtocols
 # Plotting
 import matplotlib.pyplot as plt
 
@@ -15,7 +22,28 @@ import matplotlib.pyplot as plt
 
 class polynomialBaselineFit:
     
-    def baselineSubtractionAPI(self, current, polynomialOrder, reductiveScale):
+    def __init__(self, maxIterations = 100, tolerance = 0.001, maxCachedBases = 32, polynomialOrders = range(1, 9), numWorkers = 1):
+        # Specify the stopping criteria of ModPoly/IModPoly.
+        self.maxIterations = maxIterations    # The maximum number of iterations (as in BaselineRemoval).
+        self.tolerance = tolerance            # Stop iterating once the relative change is below this value.
+        # Specify the search for the polynomial order ("auto").
+        self.polynomialOrders = polynomialOrders  # The polynomial orders to consider.
+        self.numWorkers = numWorkers              # The number of processes scoring the orders. Use 1 to score them one at a time.
+        self.bestOrders = None                    # The chosen order of each curve in the last "auto" call.
+        self.orderScores = None                   # The score of the chosen order of each curve (lower is better).
+        # Cache the polynomial bases of each potential grid.
+        self.maxCachedBases = maxCachedBases
+        self.polynomialBases = {}
+        # The number of iterations each curve took in the last call.
+        self.numIterations = None
+    
+    def baselineSubtractionAPI(self, current, polynomialOrder, reductiveScale, potential = None):
+        # Get Baseline Depending on Ox/Red Curve
+        baseline = self.modPoly(current*reductiveScale, polynomialOrder, potential)*reductiveScale
+        # Return Baseline
+        return baseline
+    
+    def baselineSubtractionAPI_External(self, current, polynomialOrder, reductiveScale):
         # Get Baseline Depending on Ox/Red Curve
         if reductiveScale == -1:
             baseObj = BaselineRemoval(-current)
@@ -26,6 +54,181 @@ class polynomialBaselineFit:
         # Return Baseline
         return baseline
     
+    def getPolynomialBasis(self, numPoints, polynomialOrder, potential = None):
+        """ An orthonormal basis (QR of the Vandermonde matrix) for the polynomials on the potential grid. """
+        # If no potential given, use the index of each point (as in BaselineRemoval).
+        if potential is None:
+            potential = np.arange(1, numPoints + 1)
+        potential = np.asarray(potential, dtype=float)
+        
+        basisKey = (potential.tobytes(), polynomialOrder)
+        if basisKey not in self.polynomialBases:
+            # Scale the potential to [-1, 1] for a well-conditioned Vandermonde matrix.
+            scaledPotential = (2*potential - potential.max() - potential.min())/max(np.ptp(potential), np.finfo(float).tiny)
+            polynomialBasis = np.linalg.qr(np.vander(scaledPotential, polynomialOrder + 1, increasing=True))[0]
+            # Remove the oldest basis if the cache is full.
+            if len(self.polynomialBases) >= self.maxCachedBases:
+                self.polynomialBases.pop(next(iter(self.polynomialBases)))
+            self.polynomialBases[basisKey] = polynomialBasis
+        return self.polynomialBases[basisKey]
+    
+    def modPoly(self, currents, polynomialOrder, potential = None):
+        # Search for the best polynomial order of each curve.
+        if polynomialOrder == "auto":
+            return self.tunePolynomialOrder(currents, potential)
+        return self.modPolyOrder(currents, polynomialOrder, potential)
+    
+    def getPeakMasks(self, residuals):
+        # Mark the main peaks (at least 10% of the largest prominence) of each baseline subtracted current.
+        residuals = np.atleast_2d(residuals)
+        peakMasks = np.zeros(residuals.shape, dtype=bool)
+        for curveInd, residual in enumerate(residuals):
+            peakIndices, peakInfo = scipy.signal.find_peaks(residual, prominence=0)
+            if len(peakIndices) == 0:
+                continue
+            mainPeaks = peakInfo["prominences"] >= 0.1*peakInfo["prominences"].max()
+            _, _, leftEdges, rightEdges = scipy.signal.peak_widths(residual, peakIndices[mainPeaks], rel_height=0.9)
+            for leftEdge, rightEdge in zip(np.floor(leftEdges).astype(int), np.ceil(rightEdges).astype(int)):
+                peakMasks[curveInd, leftEdge:rightEdge + 1] = True
+        return peakMasks
+    
+    def scoreBaselines(self, currents, baselines, peakMasks):
+        """
+        Score each baseline: the RMS of the baseline subtracted current outside the peaks, relative
+        to the height of the peaks (lower is better). A low order leaves curvature outside the peaks;
+        a high order bends around them. The peaks (peakMasks) must be the same for all the orders.
+        """
+        residuals = np.atleast_2d(currents - baselines)
+        scores = np.full(len(residuals), np.inf)
+        for curveInd, (residual, peakMask) in enumerate(zip(residuals, peakMasks)):
+            if not peakMask.any() or peakMask.all():
+                continue
+            peakHeight = residual[peakMask].max()
+            if peakHeight > 0:
+                scores[curveInd] = np.sqrt((residual[~peakMask]**2).mean())/peakHeight
+        return scores
+    
+    def tunePolynomialOrder(self, currents, potential = None):
+        """
+        ModPoly with the best order of each curve (from self.polynomialOrders). The chosen
+        orders and their scores are stored in self.bestOrders and self.orderScores.
+        """
+        currents = np.asarray(currents, dtype=float)
+        originalCurrents = np.atleast_2d(currents)
+        
+        # Find the peaks of each curve once (above a smooth baseline), so every order is scored on the same points.
+        scanPotential = potential if potential is not None else np.arange(originalCurrents.shape[1])
+        leastSquaresFit = asymmetricLeastSquares()
+        peakMasks = self.getPeakMasks([current - leastSquaresFit.getBaseline(scanPotential, current) for current in originalCurrents])
+        
+        # Fit and score every order (one polynomial basis per order).
+        orderArguments = [(originalCurrents, peakMasks, polynomialOrder, potential, self.maxIterations, self.tolerance) for polynomialOrder in self.polynomialOrders]
+        if self.numWorkers > 1:
+            with ProcessPoolExecutor(max_workers = self.numWorkers) as executor:
+                orderResults = list(executor.map(scorePolynomialOrder, orderArguments))
+        else:
+            orderResults = [scorePolynomialOrder(arguments) for arguments in orderArguments]
+        allBaselines, allScores, allIterations = (np.array(results) for results in zip(*orderResults))
+        
+        # Keep the best order of each curve (the lowest order if tied).
+        bestOrderInds = allScores.argmin(axis=0)
+        curveInds = np.arange(len(originalCurrents))
+        self.bestOrders = np.asarray(self.polynomialOrders)[bestOrderInds]
+        self.orderScores = allScores[bestOrderInds, curveInds]
+        self.numIterations = allIterations[bestOrderInds, curveInds]
+        
+        return allBaselines[bestOrderInds, curveInds].reshape(currents.shape)
+    
+    def modPolyOrder(self, currents, polynomialOrder, potential = None):
+        """
+        Modified polyfit (Lieber & Mahadevan-Jansen, 2003) for one curve or a stack of curves.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            currents: The current of each curve. Dim: numScanPoints or numCurves, numScanPoints
+            polynomialOrder: The order of the polynomial baseline.
+            potential: The potential shared by the curves. If None, the index of each point is used.
+        Output Variable Definitions:
+            baselines: The baseline of each curve (same shape as currents).
+        The number of iterations of each curve is stored in self.numIterations.
+        --------------------------------------------------------------------------
+        """
+        currents = np.asarray(currents, dtype=float)
+        originalCurrents = np.atleast_2d(currents)
+        polynomialBasis = self.getPolynomialBasis(originalCurrents.shape[1], polynomialOrder, potential)
+        
+        oldCurrents = originalCurrents.copy()
+        baselines = np.empty_like(originalCurrents)
+        numIterations = np.zeros(len(originalCurrents), dtype=int)
+        activeCurves = np.arange(len(originalCurrents))
+        while len(activeCurves) != 0:
+            # Fit the polynomial to all the curves still changing.
+            fitCurrents = (oldCurrents[activeCurves] @ polynomialBasis) @ polynomialBasis.T
+            newCurrents = np.minimum(originalCurrents[activeCurves], fitCurrents)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                relativeChange = np.abs((newCurrents - oldCurrents[activeCurves])/oldCurrents[activeCurves]).sum(axis=1)
+            
+            # Store the results.
+            baselines[activeCurves] = fitCurrents
+            oldCurrents[activeCurves] = newCurrents
+            numIterations[activeCurves] += 1
+            # Keep iterating the curves that did not converge.
+            activeCurves = activeCurves[(relativeChange >= self.tolerance) & (numIterations[activeCurves] <= self.maxIterations)]
+        
+        self.numIterations = numIterations
+        return baselines.reshape(currents.shape)
+    
+    def iModPoly(self, currents, polynomialOrder, potential = None):
+        """
+        Improved modified polyfit (Zhao et al., 2007) for one curve or a stack of curves.
+        --------------------------------------------------------------------------
+        The points above the first fit (plus its deviation) are removed. The fit to the remaining
+        points is repeated, clipping the current to the fit plus its deviation, until the deviation
+        stops changing. Same inputs and outputs as modPoly.
+        --------------------------------------------------------------------------
+        """
+        currents = np.asarray(currents, dtype=float)
+        originalCurrents = np.atleast_2d(currents)
+        polynomialBasis = self.getPolynomialBasis(originalCurrents.shape[1], polynomialOrder, potential)
+        
+        # The first fit: remove the points above the fit (plus its deviation).
+        polynomialCoefficients = originalCurrents @ polynomialBasis
+        fitCurrents = polynomialCoefficients @ polynomialBasis.T
+        oldDeviations = (originalCurrents - fitCurrents).std(axis=1)
+        fitMask = originalCurrents <= fitCurrents + oldDeviations[:, None]
+        oldCurrents = originalCurrents.copy()
+        
+        numIterations = np.ones(len(originalCurrents), dtype=int)
+        activeCurves = np.arange(len(originalCurrents))
+        for iteration in range(2, self.maxIterations + 1):
+            if len(activeCurves) == 0:
+                break
+            activeMask = fitMask[activeCurves]
+            # Fit the polynomial to the remaining points of each curve.
+            maskedBasis = activeMask[:, :, None]*polynomialBasis
+            gramMatrices = np.einsum("cnk,nj->ckj", maskedBasis, polynomialBasis)
+            projections = np.einsum("cnk,cn->ck", maskedBasis, oldCurrents[activeCurves])
+            polynomialCoefficients[activeCurves] = (np.linalg.pinv(gramMatrices) @ projections[:, :, None])[..., 0]
+            fitCurrents = polynomialCoefficients[activeCurves] @ polynomialBasis.T
+            
+            # Calculate the deviation of the remaining points from the fit.
+            numFitPoints = activeMask.sum(axis=1)
+            residuals = np.where(activeMask, oldCurrents[activeCurves] - fitCurrents, 0)
+            residuals -= activeMask*(residuals.sum(axis=1)/numFitPoints)[:, None]
+            deviations = np.sqrt((residuals**2).sum(axis=1)/numFitPoints)
+            numIterations[activeCurves] = iteration
+            
+            # Stop the curves whose deviation did not change.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                convergedCurves = np.abs((deviations - oldDeviations[activeCurves])/deviations) < self.tolerance
+            # Clip the remaining points to the fit plus its deviation.
+            clippedCurrents = np.minimum(oldCurrents[activeCurves], fitCurrents + deviations[:, None])
+            oldCurrents[activeCurves] = np.where(activeMask & ~convergedCurves[:, None], clippedCurrents, oldCurrents[activeCurves])
+            oldDeviations[activeCurves] = deviations
+            activeCurves = activeCurves[~convergedCurves]
+        
+        self.numIterations = numIterations
+        return (polynomialCoefficients @ polynomialBasis.T).reshape(currents.shape)
+    
     def baselineSubtraction(self, potential, current, polynomialOrder, Iterations, reductiveScale):
         if reductiveScale == -1:
             baseline = - self.getBaseline(potential, -current, Iterations, polynomialOrder)
@@ -39,16 +242,124 @@ class polynomialBaselineFit:
         for _ in range(Iterations):
             fitI = np.polyfit(x, yHold, order)
             baseline = np.polyval(fitI, x)
-            for i in range(len(y)):
-                if yHold[i] > baseline[i]:
-                    yHold[i] = baseline[i]
+            yHold = np.minimum(yHold, baseline)
         return baseline
         
+def scorePolynomialOrder(arguments):
+    # Fit and score one polynomial order for all the curves (run in a worker process).
+    currents, peakMasks, polynomialOrder, potential, maxIterations, tolerance = arguments
+    polynomialFit = polynomialBaselineFit(maxIterations, tolerance)
+    baselines = polynomialFit.modPolyOrder(currents, polynomialOrder, potential)
+    return baselines, polynomialFit.scoreBaselines(currents, baselines, peakMasks), polynomialFit.numIterations
+
+# ---------------------------------------------------------------------------#
+# ------------------- Asymmetric Least Squares Baseline -------------------- #
+
+class asymmetricLeastSquares:
+    """
+    A smooth baseline that stays under the peaks (Eilers & Boelens, 2005; Baek et al., 2015).
+    --------------------------------------------------------------------------
+    The baseline z minimizes sum(w*(y - z)**2) + lam*sum(diff(z, 2)**2). The points above the 
+    baseline (the peaks) are given small weights and the fit is repeated. The system is banded
+    (pentadiagonal), so each iteration is O(n).
+        "arPLS": The weights follow a logistic function of the residuals (no asymmetry to tune).
+        "AsLS": The points above the baseline get a weight of 'asymmetry'; the rest, 1 - asymmetry.
+    --------------------------------------------------------------------------
+    """
+    
+    def __init__(self, smoothness = 4E-6, weighting = "arPLS", asymmetry = 0.01, maxIterations = 50, tolerance = 1E-3):
+        # Specify the baseline parameters.
+        self.smoothness = smoothness        # The penalty on the curvature of the baseline (scaled by the sampling frequency, so it does not depend on the number of points).
+        self.weighting = weighting          # Options: "arPLS" or "AsLS".
+        self.asymmetry = asymmetry          # The weight of the points above the baseline ("AsLS" only).
+        self.maxIterations = maxIterations  # The maximum number of reweighting iterations.
+        self.tolerance = tolerance          # Stop once the weights change less than this (relative).
+        assert self.weighting in ["arPLS", "AsLS"], "Unknown weighting: " + str(weighting)
+        # Larger penalties are too ill-conditioned to solve in double precision (very dense scans).
+        self.maxPenalty = 1E10
+        # Cache the penalty of each number of points.
+        self.penaltyBands = {}
+        # The number of iterations in the last call.
+        self.numIterations = None
+    
+    def getPenaltyBands(self, numPoints):
+        # The upper bands of D.T @ D, where D is the second difference matrix.
+        if numPoints not in self.penaltyBands:
+            secondDiff = scipy.sparse.diags([1, -2, 1], [0, 1, 2], shape=(max(0, numPoints - 2), numPoints))
+            penalty = (secondDiff.T @ secondDiff).todia()
+            penaltyBands = np.zeros((3, numPoints))
+            for bandInd in range(3):
+                offset = 2 - bandInd
+                if offset < numPoints:
+                    penaltyBands[bandInd, offset:] = penalty.diagonal(offset)
+            self.penaltyBands[numPoints] = penaltyBands
+        return self.penaltyBands[numPoints]
+    
+    def getBaseline(self, potential, current):
+        current = np.asarray(current, dtype=float)
+        numPoints = len(current)
+        if numPoints < 3:
+            return current.copy()
+        
+        # Scale the smoothness by the sampling frequency (points per volt).
+        samplingFreq = abs(numPoints/(potential[-1] - potential[0]))
+        penaltyBands = min(self.smoothness*samplingFreq**4, self.maxPenalty)*self.getPenaltyBands(numPoints)
+        
+        weights = np.ones(numPoints)
+        for iteration in range(1, self.maxIterations + 1):
+            # Solve (W + lam*D.T @ D) z = W y.
+            systemBands = penaltyBands.copy()
+            systemBands[2] += weights
+            try:
+                baseline = scipy.linalg.solveh_banded(systemBands, weights*current, check_finite=False)
+            except np.linalg.LinAlgError:
+                # If the smoothness is too large for a Cholesky solve, use the banded LU solver.
+                fullBands = np.vstack((systemBands, np.roll(systemBands[1], -1)[None], np.roll(systemBands[0], -2)[None]))
+                baseline = scipy.linalg.solve_banded((2, 2), fullBands, weights*current, check_finite=False)
+            
+            # Reweight the points: the peaks lie above the baseline.
+            residuals = current - baseline
+            if self.weighting == "AsLS":
+                newWeights = np.where(residuals > 0, self.asymmetry, 1 - self.asymmetry)
+            else:
+                negativeResiduals = residuals[residuals < 0]
+                if len(negativeResiduals) < 2 or negativeResiduals.std() == 0:
+                    break
+                meanResidual = negativeResiduals.mean(); stdResidual = negativeResiduals.std()
+                newWeights = scipy.special.expit(-2*(residuals - (2*stdResidual - meanResidual))/stdResidual)
+            
+            # Stop when the weights stop changing.
+            weightChange = np.linalg.norm(weights - newWeights)/np.linalg.norm(weights)
+            weights = newWeights
+            if weightChange < self.tolerance:
+                break
+        
+        self.numIterations = iteration
+        return baseline
+    
 # ---------------------------------------------------------------------------#
 # ---------------------- Linear Baseline Subtraction  ---------------------- #
 
 class bestLinearFit2:
     
+    def __init__(self, tangentSearch = "hull", maxScoringMemory = 64*1024**2, savgolFilter = None, minPeakSNR = 0, timeBudget = None):
+        # Share the Savitzky-Golay engine (and its cached coefficients) if one is given.
+        self.savgolFilter = savgolFilter if savgolFilter is not None else _filteringProtocols.savgolFilter()
+        # Specify how to search for the tangent line under each peak.
+        self.tangentSearch = tangentSearch        # Options: "hull" (supporting line search), "vectorized" (score pairs in blocks), or "loops" (check every pair).
+        self.maxScoringMemory = maxScoringMemory  # The maximum memory (bytes) used to score a block of tangent lines at once.
+        assert self.tangentSearch in ["hull", "vectorized", "loops"], "Unknown tangent search: " + str(tangentSearch)
+        # Specify the cost limits of each curve.
+        self.minPeakSNR = minPeakSNR    # Curves whose tallest peak is below this many noise levels have no peak (skip the search). Use 0 to search every curve.
+        self.timeBudget = timeBudget    # The time (seconds) spent on the tangent lines of one curve before using valley baselines. None for no limit.
+        assert self.timeBudget is None or self.timeBudget >= 0, "The time budget must be None or positive: " + str(timeBudget)
+        self.deadline = None        # The time the tangent searches of the current curve must stop (set by findBaseline).
+        self.outOfTime = False      # If a search stopped at the deadline.
+        
+        # Holder for the decisions made on the last curve(s).
+        self.baselineInfo = {}      # The decisions on the last curve given to findBaseline.
+        self.allBaselineInfo = []   # The decisions on each curve given to findBaselines.
+    
     def setSamplingFreq(self, potential):
         # General parameters.
         self.samplingFreq = abs(len(potential)/(potential[-1] - potential[0]))
@@ -57,39 +368,104 @@ class bestLinearFit2:
         self.ignoredBoundaryPoints = int(self.samplingFreq*0.02)
         self.minPeakDuration = int(self.samplingFreq*0.04)
     
-    def findBaseline(self, xData, yData):
+    def findBaselines(self, xData, yDataStack, rawDataStack = None):
+        """
+        Find the baseline of each curve in a stack sharing one potential axis.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            xData: The potential shared by all the curves. Dim: numScanPoints
+            yDataStack: The current of each curve. Dim: numCurves, numScanPoints
+            rawDataStack: The unfiltered current of each curve, used to estimate the noise. Dim: numCurves, numScanPoints
+        Output Variable Definitions:
+            baselines: The baseline of each curve. Dim: numCurves, numScanPoints
+            allIndCuts: The baseline segment boundaries (finalIndCuts) of each curve. Dim: numCurves, numBoundaries
+        --------------------------------------------------------------------------
+        """
+        yDataStack = np.asarray(yDataStack, dtype=float)
+        # Calculate the sampling parameters once.
         self.setSamplingFreq(xData)
+        # Calculate the derivative of all the curves at once.
+        firstDerivs = self.savgolFilter.savgolFilter(yDataStack, self.getDerivativeWindow(), 3, deriv=1, axis=-1)
         
+        baselines = np.empty_like(yDataStack); allIndCuts = []; self.allBaselineInfo = []
+        for curveInd in range(len(yDataStack)):
+            rawData = None if rawDataStack is None else rawDataStack[curveInd]
+            baselines[curveInd], finalIndCuts = self.findBaseline(xData, yDataStack[curveInd], firstDerivs[curveInd], rawData)
+            allIndCuts.append(finalIndCuts)
+            self.allBaselineInfo.append(dict(self.baselineInfo))
+        return baselines, allIndCuts
+    
+    def findBaseline(self, xData, yData, firstDeriv = None, rawData = None):
+        """
+        Find the linear baseline under each peak of one curve.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            xData: The potential of the curve. Dim: numScanPoints
+            yData: The current of the curve. Dim: numScanPoints
+            firstDeriv: The first derivative of yData. If None, it is calculated here. Dim: numScanPoints
+            rawData: The unfiltered current of the curve, used to estimate the noise. Dim: numScanPoints
+        Output Variable Definitions:
+            baseline: The baseline of the curve. Dim: numScanPoints
+            finalIndCuts: The boundaries of the baseline segments; each (odd, even) pair of
+                indices is a line drawn under a peak. Dim: An even number of indices
+        The decisions made on the curve are stored in self.baselineInfo:
+            "Peak SNR": The peak signal-to-noise ratio from estimatePeakSNR.
+            "Peak Screen": "Peak" or "No Peak" (below self.minPeakSNR); "Off" if self.minPeakSNR is 0.
+            "Baseline Method": "Tangent", "Valley" (the time budget ran out), or "None" (no baseline).
+        --------------------------------------------------------------------------
+        """
+        startTime = time.time()
         # ------------------------- Find the Peaks ------------------------- #
-        # Calculate derivative.
-        firstDeriv = scipy.signal.savgol_filter(yData, self.convert_to_odd(max(5, int(self.samplingFreq*0.04))), 3, deriv=1)
+        # Calculate derivative (findBaselines already did this for the whole stack).
+        if firstDeriv is None:
+            self.setSamplingFreq(xData)
+            firstDeriv = self.savgolFilter.savgolFilter(yData, self.getDerivativeWindow(), 3, deriv=1)
+        
+        # Skip the search on curves that are too flat to have a peak.
+        peakSNR = self.estimatePeakSNR(yData, rawData)
+        self.baselineInfo = {"Peak SNR": float(peakSNR), "Peak Screen": "Peak" if self.minPeakSNR > 0 else "Off", "Baseline Method": "None"}
+        if peakSNR < self.minPeakSNR:
+            print("\tNo Peak Found in Data (Peak SNR = " + str(round(peakSNR, 2)) + ")")
+            self.baselineInfo["Peak Screen"] = "No Peak"
+            return yData, [0, len(yData)]
         
         # Find the Peak
-        peakIndices = list(self.findPeak(xData, yData, deriv=False))     
+        peakIndices = list(self.findPeak(xData, yData, deriv=False, firstDeriv=firstDeriv))     
         peakIndices.extend(self.findPeak(xData, firstDeriv, deriv=True))
         peakIndices = list(set(peakIndices))
         # Return None if No Peak Found
         if len(peakIndices) == 0:
             print("\tNo Peak Found in Data")
-            return yData
+            return yData, [0, len(yData)]
         # Sort the Indices so They Appear 1-by-1
         peakIndices.sort()
         print("\tInitial Peak Indices:", peakIndices, xData[peakIndices])
         # ------------------------------------------------------------------ #
 
         # ------------------ Find and Remove the Baseline ------------------ #
-        finalIndices = []; peakIndCuts = []
+        finalIndices = []; peakIndCuts = []; usedValleys = False
+        # The tangent searches stop once the time budget runs out.
+        self.deadline = None if self.timeBudget is None else startTime + self.timeBudget; self.outOfTime = False
         for peakInd in peakIndices:
             # Get Baseline from Best Linear Fit
-            leftCutInd, rightCutInd = self.findLinearBaseline(xData, yData, peakInd)
+            if not self.pastDeadline():
+                leftCutInd, rightCutInd = self.findLinearBaseline(xData, yData, peakInd)
+            # Use the valleys if out of time (before or during the search)
+            if self.outOfTime:
+                leftCutInd, rightCutInd = self.findValleyBaseline(yData, peakInd)
+                usedValleys = True
             if None in [leftCutInd, rightCutInd] or rightCutInd - leftCutInd < self.minPeakDuration:
                 continue
             finalIndices.append(peakInd)
             peakIndCuts.extend([leftCutInd, rightCutInd])
+        self.deadline = None
         
         if len(finalIndices) == 0:
             print("\tNo Baseline Data Found")
-            return yData
+            return yData, [0, len(yData)]
+        if usedValleys:
+            print("\tTime Budget Exceeded: Using Valley Baselines")
+        self.baselineInfo["Baseline Method"] = "Valley" if usedValleys else "Tangent"
         # ------------------------------------------------------------------ #
         
         # ------------------ Organize the Peak Boundaries ------------------ #
@@ -123,28 +499,47 @@ class bestLinearFit2:
         # ------------------------------------------------------------------ #
 
         # --------------------- Calculate the Baseline --------------------- #
-        previousBoundaryInd = finalIndCuts[0]
-        baseline = []; removeData = True;
+        baseline = self.buildBaseline(xData, yData, finalIndCuts)
+        # ------------------------------------------------------------------ #
+        return baseline, finalIndCuts
+    
+    def buildBaseline(self, xData, yData, finalIndCuts):
+        """
+        Piece together the baseline from its segments, writing each one in place.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            xData: The potential of the curve. Dim: numScanPoints
+            yData: The current of the curve. Dim: numScanPoints
+            finalIndCuts: The segment boundaries, starting at 0 and ending at numScanPoints. The segments
+                alternate between keeping yData and drawing a line under a peak. Dim: An even number of indices
+        --------------------------------------------------------------------------
+        """
+        baseline = np.empty(len(yData), dtype=np.result_type(yData, float))
+        
+        previousBoundaryInd = finalIndCuts[0]; removeData = True
         for peakBoundaryInd in finalIndCuts[1:]:
             
             if removeData:
-                baseline = np.concatenate((baseline, yData[previousBoundaryInd:peakBoundaryInd]))
-            else:
+                baseline[previousBoundaryInd:peakBoundaryInd] = yData[previousBoundaryInd:peakBoundaryInd]
+            elif previousBoundaryInd < peakBoundaryInd:
                 # Draw a Linear Line Between the Points
                 lineSlope = (yData[previousBoundaryInd] - yData[peakBoundaryInd])/(xData[previousBoundaryInd] - xData[peakBoundaryInd])
                 slopeIntercept = yData[previousBoundaryInd] - lineSlope*xData[previousBoundaryInd]
-                linearFit = lineSlope*xData + slopeIntercept
-                
-                # Piece Together yData's Baseline
-                baseline = np.concatenate((baseline, linearFit[previousBoundaryInd:peakBoundaryInd]))
+                # Only evaluate the line inside the segment.
+                np.multiply(lineSlope, xData[previousBoundaryInd:peakBoundaryInd], out=baseline[previousBoundaryInd:peakBoundaryInd])
+                baseline[previousBoundaryInd:peakBoundaryInd] += slopeIntercept
             
             # Reset for the Next Round
             previousBoundaryInd = peakBoundaryInd
             removeData = not removeData
-        # ------------------------------------------------------------------ #
+        
         return baseline
     
-    def findPeak(self, xData, yData, deriv = False):
+    def getDerivativeWindow(self):
+        # The savgol window used to find the first derivative of a curve.
+        return self.convert_to_odd(max(5, int(self.samplingFreq*0.04)))
+    
+    def findPeak(self, xData, yData, deriv = False, firstDeriv = None):
         # Find All Peaks in the Data
         peakInfo = scipy.signal.find_peaks(yData, prominence=10E-10, distance = max(3, int(self.samplingFreq*0.02)))
         
@@ -155,7 +550,12 @@ class bestLinearFit2:
         # If peaks are found in the data
         if len(peakIndices) == 0 and not deriv:
             # Analyze the peaks in the first derivative.
-            filteredVelocity = scipy.signal.savgol_filter(yData, max(3, self.convert_to_odd(int(self.samplingFreq*0.04))), 3, deriv=1)
+            velocityWindow = max(3, self.convert_to_odd(int(self.samplingFreq*0.04)))
+            # Reuse the derivative of the curve if it was found with the same window.
+            if firstDeriv is not None and velocityWindow == self.getDerivativeWindow():
+                filteredVelocity = firstDeriv
+            else:
+                filteredVelocity = self.savgolFilter.savgolFilter(yData, velocityWindow, 3, deriv=1)
             return self.findPeak(xData, filteredVelocity, deriv = True)
         # If no peaks found, return an empty list.
         return peakIndices
@@ -177,7 +577,312 @@ class bestLinearFit2:
         
         return peakIndices
 
+    def estimatePeakSNR(self, yData, rawData = None):
+        """
+        A cheap estimate of how many noise levels the tallest peak rises above its surroundings.
+        --------------------------------------------------------------------------
+        The signal is the largest prominence of yData (in current units), away from the boundaries. The 
+        noise is the robust (MAD) standard deviation of the raw residual: the unfiltered current minus yData.
+        Both are in current units, so the ratio does not depend on the units or the sampling density.
+        Without the raw data, the residual of yData around its own Savitzky-Golay fit is used (this
+        underestimates the noise, so fewer curves are screened out).
+        --------------------------------------------------------------------------
+        """
+        yData = np.asarray(yData, dtype=float)
+        searchData = yData[self.ignoredBoundaryPoints:len(yData) - self.ignoredBoundaryPoints]
+        if len(searchData) < 3:
+            return np.inf
+        # Find the height of the tallest peak.
+        peakHeight = scipy.signal.find_peaks(searchData, prominence=0)[1]["prominences"].max(initial=0)
+        # Estimate the noise of the data.
+        if rawData is None:
+            rawData = yData; yData = self.savgolFilter.savgolFilter(yData, self.getDerivativeWindow(), 3)
+        residual = np.asarray(rawData, dtype=float) - yData
+        noiseLevel = 1.4826*np.median(np.abs(residual - np.median(residual)))
+        # Without noise, nothing can be ruled out.
+        if noiseLevel == 0:
+            return np.inf
+        return peakHeight/noiseLevel
+    
+    def findValleyBaseline(self, yData, peakInd):
+        # Connect the lowest points on each side of the peak (away from the boundaries).
+        leftBoundary = self.ignoredBoundaryPoints; rightBoundary = len(yData) - self.ignoredBoundaryPoints
+        if not leftBoundary < peakInd < rightBoundary - 1:
+            return None, None
+        leftCutInd = leftBoundary + int(np.argmin(yData[leftBoundary:peakInd]))
+        rightCutInd = int(peakInd) + 1 + int(np.argmin(yData[peakInd+1:rightBoundary]))
+        return leftCutInd, rightCutInd
+    
+    def pastDeadline(self):
+        # Check if the time budget of the curve ran out (the searches then return None, None).
+        if self.deadline is not None and self.deadline < time.time():
+            self.outOfTime = True
+        return self.outOfTime
+    
     def findLinearBaseline(self, xData, yData, peakInd):
+        if self.tangentSearch == "hull":
+            return self.findLinearBaseline_Hull(xData, yData, peakInd)
+        elif self.tangentSearch == "vectorized":
+            return self.findLinearBaseline_Vectorized(xData, yData, peakInd)
+        return self.findLinearBaseline_Loops(xData, yData, peakInd)
+    
+    def findLinearBaseline_Hull(self, xData, yData, peakInd):
+        """
+        Find the widest line under the peak with no points below it (a supporting line of the lower hull).
+        --------------------------------------------------------------------------
+        A line from leftInd to rightInd has no points under it in its window [leftInd - checkPeakBuffer,
+        rightInd + checkPeakBuffer] if its slope is the smallest slope from leftInd to any point on its
+        right (up to rightInd + checkPeakBuffer) and the largest slope to any point on its left. 
+            1) Sweeping left from the peak, the lower hull of [leftInd, peakInd+2] gives the smallest slope 
+               from leftInd to the peak. Only points that can hold a line under both sides are kept.
+            2) For each kept point, a running minimum of the slopes finds all the valid right points at once.
+        If no such line exists, the best line has points below it: findLinearBaseline_Ranked finds the
+        line with the fewest, without scoring every pair.
+        --------------------------------------------------------------------------
+        """
+        # Define the thresholds used by the search over every pair.
+        maxBadPointsTotal = int(self.samplingFreq*0.05)
+        checkPeakBuffer = max(1, int(self.samplingFreq*0.02))
+        # Setup the boundaries of the search.
+        lastLeftInd = peakInd - 2; firstRightInd = peakInd + 2
+        if maxBadPointsTotal == 0 or lastLeftInd < 0 or len(yData) <= firstRightInd:
+            return None, None
+        
+        # Orient the potential so it increases (a point stays on the same side of a line).
+        potential, current = xData, yData
+        xData = np.asarray(xData)*(1 if xData[0] <= xData[-1] else -1)
+        yData = np.asarray(yData)
+        
+        # Allow for rounding in the slopes: every line is checked exactly below.
+        slopeTolerance = 1E-9*np.abs(np.diff(yData)/np.diff(xData)).max(initial = 0)
+        
+        # ---------------------- Find the Left Tangents ---------------------- #
+        leftCandidates = []; hullInds = []
+        for leftInd in range(firstRightInd, -1, -1):
+            if self.pastDeadline():
+                return None, None
+            # Add the point to the left of the lower hull of [leftInd, firstRightInd].
+            while len(hullInds) >= 2 and (xData[hullInds[-1]] - xData[leftInd])*(yData[hullInds[-2]] - yData[leftInd]) \
+                    <= (yData[hullInds[-1]] - yData[leftInd])*(xData[hullInds[-2]] - xData[leftInd]):
+                hullInds.pop()
+            hullInds.append(leftInd)
+            if lastLeftInd < leftInd:
+                continue
+            
+            # The smallest slope from leftInd to the peak is along the lower hull.
+            hullSlope = (yData[hullInds[-2]] - yData[leftInd])/(xData[hullInds[-2]] - xData[leftInd])
+            # The points to the left must also be above the line.
+            bufferInds = np.arange(max(0, leftInd - checkPeakBuffer), leftInd)
+            leftSlope = ((yData[leftInd] - yData[bufferInds])/(xData[leftInd] - xData[bufferInds])).max(initial = -np.inf)
+            if leftSlope <= hullSlope + slopeTolerance:
+                leftCandidates.append((leftInd, leftSlope))
+        
+        # ---------------------- Find the Right Tangents --------------------- #
+        bestPair = None
+        for leftInd, leftSlope in leftCandidates:
+            if self.pastDeadline():
+                return None, None
+            # Calculate the slopes to all the points on the right.
+            slopes = (yData[leftInd+1:] - yData[leftInd])/(xData[leftInd+1:] - xData[leftInd])
+            minSlopes = np.minimum.accumulate(slopes)
+            
+            # The line must be the lowest line through the window and hold the left points above.
+            rightInds = np.arange(max(firstRightInd, leftInd + self.minPeakDuration), len(yData))
+            windowEndInds = np.minimum(rightInds + checkPeakBuffer, len(yData) - 1)
+            rightSlopes = slopes[rightInds - leftInd - 1]
+            goodRightInds = rightInds[(rightSlopes <= minSlopes[windowEndInds - leftInd - 1] + slopeTolerance) & (leftSlope <= rightSlopes + slopeTolerance)]
+            
+            # Keep the widest line with no points below it (the first one found in the search over every pair).
+            for rightInd in goodRightInds[::-1]:
+                if bestPair is not None and (rightInd - leftInd, -rightInd) <= (bestPair[1] - bestPair[0], -bestPair[1]):
+                    break
+                if self.countWrongSideOfTangent(potential, current, leftInd, rightInd, checkPeakBuffer) == 0:
+                    bestPair = (leftInd, int(rightInd))
+                    break
+        
+        # If Nothing Found, Try and Return a Semi-Optimal Tangent Position
+        if bestPair is None:
+            return self.findLinearBaseline_Ranked(potential, current, peakInd)
+        return bestPair
+    
+    def findLinearBaseline_Ranked(self, xData, yData, peakInd):
+        """
+        Find the line with the fewest points below it, then the widest (as in the loops), scoring only the
+        pairs that could have fewer than numSmallest points below them.
+        --------------------------------------------------------------------------
+        A point right of leftInd is below the line to rightInd only if its slope from leftInd is smaller.
+        So a line with fewer than numSmallest points below it has a slope no larger than the numSmallest-th
+        smallest slope from leftInd to the end of its window. Sweeping right, the numSmallest smallest slopes
+        of every leftInd are kept, and only the pairs that pass are scored exactly (in the loops' order).
+        numSmallest doubles until the best line has fewer than numSmallest points below it.
+            Cost: each sweep is O(n^2 numSmallest) time and holds numLeft*numSmallest slopes; the passing pairs
+            are scored in blocks under self.maxScoringMemory. Lines with few points below them pass few pairs.
+            Worst case: the best line has many points below it (or none is good), so numSmallest grows to
+            maxBadPointsTotal and many pairs pass: up to O(n^2 w) time, like findLinearBaseline_Vectorized.
+        --------------------------------------------------------------------------
+        """
+        # Define the thresholds used by the search over every pair.
+        maxBadPointsTotal = int(self.samplingFreq*0.05)
+        checkPeakBuffer = max(1, int(self.samplingFreq*0.02))
+        # Setup the boundaries of the search (lines with no points below them are found by the hull).
+        lastLeftInd = peakInd - 2; firstRightInd = peakInd + 2
+        if maxBadPointsTotal <= 1 or lastLeftInd < 0 or len(yData) <= firstRightInd:
+            return None, None
+        
+        numSmallest = 2
+        while True:
+            numSmallest = min(numSmallest, maxBadPointsTotal)
+            bestPair, bestNumBelow = self.scoreRankedTangents(xData, yData, peakInd, numSmallest, checkPeakBuffer, maxBadPointsTotal)
+            if self.outOfTime:
+                return None, None
+            # Every line with fewer than numSmallest points below it was scored.
+            if (bestPair is not None and bestNumBelow < numSmallest) or numSmallest == maxBadPointsTotal:
+                return bestPair if bestPair is not None else (None, None)
+            numSmallest *= 2
+    
+    def scoreRankedTangents(self, xData, yData, peakInd, numSmallest, checkPeakBuffer, maxBadPointsTotal):
+        # Orient the potential so it increases (a point stays on the same side of a line).
+        potential, current = np.asarray(xData), np.asarray(yData)
+        xData = potential*(1 if potential[0] <= potential[-1] else -1); yData = current
+        numPoints = len(yData); lastLeftInd = peakInd - 2; firstRightInd = peakInd + 2
+        # Only rule out the points clearly below a line: every passing line is checked exactly.
+        maxSlope = np.abs(np.diff(yData)/np.diff(xData)).max(initial = 0)
+        slopeTolerance = 1E-9*(np.abs(yData).max() + maxSlope*np.abs(xData).max())/np.diff(xData).min()
+        
+        # Hold the numSmallest smallest slopes from each leftInd (in the loops' order: decreasing).
+        leftInds = np.arange(lastLeftInd, -1, -1)
+        smallestSlopes = np.full((len(leftInds), numSmallest), np.inf)
+        largestPositions = np.zeros(len(leftInds), dtype = int); cutoffSlopes = np.full(len(leftInds), np.inf)
+        # Size the blocks of passing pairs with the memory left.
+        blockSize = max(1, int((self.maxScoringMemory - smallestSlopes.nbytes) // (numPoints*(8 + 1) + 256)))
+        
+        bestPair = None; bestScore = np.iinfo(np.int64).max
+        blockLeft = []; blockRight = []; numInBlock = 0
+        for pointInd in range(1, numPoints):
+            if self.pastDeadline():
+                return None, None
+            # Add the slope to this point from each leftInd before it.
+            firstActive = max(0, lastLeftInd - pointInd + 1)
+            slopes = (yData[pointInd] - yData[leftInds[firstActive:]])/(xData[pointInd] - xData[leftInds[firstActive:]])
+            newSmallest = np.flatnonzero(slopes < cutoffSlopes[firstActive:])
+            rows = firstActive + newSmallest
+            smallestSlopes[rows, largestPositions[rows]] = slopes[newSmallest]
+            largestPositions[rows] = smallestSlopes[rows].argmax(axis = 1)
+            cutoffSlopes[rows] = smallestSlopes[rows, largestPositions[rows]]
+            
+            # Find the rightInds whose window ends at this point.
+            lastWindowRight = pointInd - checkPeakBuffer if pointInd < numPoints - 1 else pointInd
+            for rightInd in range(max(firstRightInd, pointInd - checkPeakBuffer), lastWindowRight + 1):
+                # Keep the leftInds far enough away that could have fewer than numSmallest points below the line.
+                firstLeft = max(0, lastLeftInd - (rightInd - self.minPeakDuration))
+                rightSlopes = (yData[rightInd] - yData[leftInds[firstLeft:]])/(xData[rightInd] - xData[leftInds[firstLeft:]])
+                passingLefts = leftInds[firstLeft:][rightSlopes <= cutoffSlopes[firstLeft:] + slopeTolerance]
+                blockLeft.append(passingLefts); blockRight.append(np.full(len(passingLefts), rightInd))
+                numInBlock += len(passingLefts)
+            
+            # Score the passing pairs exactly.
+            if blockSize <= numInBlock or pointInd == numPoints - 1:
+                blockLeft = np.concatenate(blockLeft); blockRight = np.concatenate(blockRight)
+                for blockStart in range(0, len(blockLeft), blockSize):
+                    blockScores = self.scoreTangentPairs(potential, current, blockLeft[blockStart:blockStart + blockSize], blockRight[blockStart:blockStart + blockSize], checkPeakBuffer, maxBadPointsTotal)
+                    bestInd = blockScores.argmin()
+                    if blockScores[bestInd] < bestScore:
+                        bestScore = blockScores[bestInd]
+                        bestPair = (int(blockLeft[blockStart + bestInd]), int(blockRight[blockStart + bestInd]))
+                blockLeft = []; blockRight = []; numInBlock = 0
+        
+        # Return the best line and the number of points below it.
+        if bestPair is None:
+            return None, None
+        return bestPair, int(bestScore + bestPair[1] - bestPair[0])//numPoints
+    
+    def countWrongSideOfTangent(self, xData, yData, leftInd, rightInd, checkPeakBuffer):
+        # Initialize range of data to check
+        xDataCut = xData[max(0, leftInd - checkPeakBuffer):rightInd + 1 + checkPeakBuffer]
+        yDataCut = yData[max(0, leftInd - checkPeakBuffer):rightInd + 1 + checkPeakBuffer]
+        
+        # Draw a Linear Line Between the Points
+        lineSlope = (yData[leftInd] - yData[rightInd])/(xData[leftInd] - xData[rightInd])
+        slopeIntercept = yData[leftInd] - lineSlope*xData[leftInd]
+        linearFit = lineSlope*xDataCut + slopeIntercept
+
+        # Find the Number of Points Above the Tangent Line
+        return (linearFit - yDataCut > 0).sum()
+    
+    def findLinearBaseline_Vectorized(self, xData, yData, peakInd):
+        """
+        Score every (leftInd, rightInd) pair like findLinearBaseline_Loops, a block of pairs at a time.
+        --------------------------------------------------------------------------
+        The pairs are ordered as in the loops (rightInd increasing, then leftInd decreasing) so ties are
+        broken the same way. The pairs of each block are made from their place in this order, so the
+        memory of a search (pairs and lines) stays under self.maxScoringMemory for any curve length.
+        --------------------------------------------------------------------------
+        """
+        # Define a threshold for distinguishing good/bad lines
+        maxBadPointsTotal = int(self.samplingFreq*0.05)
+        checkPeakBuffer = max(1, int(self.samplingFreq*0.02))
+        xData = np.asarray(xData); yData = np.asarray(yData)
+        numPoints = len(yData)
+        
+        # For each rightInd, the leftInds far enough away run from firstLeftInd down to 0.
+        rightRange = np.arange(peakInd+2, numPoints)
+        firstLeftInds = np.minimum(peakInd - 2, rightRange - self.minPeakDuration)
+        # Find where the pairs of each rightInd start in the order of the loops.
+        pairOffsets = np.concatenate(([0], np.cumsum(np.maximum(0, firstLeftInds + 1))))
+        numPairs = int(pairOffsets[-1])
+        if numPairs == 0 or maxBadPointsTotal == 0:
+            return None, None
+        
+        # Size the blocks: the line (float) and mask (bool) of each pair over the data, and the pair's own arrays.
+        blockSize = max(1, int(self.maxScoringMemory // (numPoints*(8 + 1) + 256)))
+        
+        bestPair = None; bestScore = np.iinfo(np.int64).max
+        for blockStart in range(0, numPairs, blockSize):
+            if self.pastDeadline():
+                return None, None
+            # Make the pairs of this block only.
+            pairInds = np.arange(blockStart, min(blockStart + blockSize, numPairs))
+            rightPositions = np.searchsorted(pairOffsets, pairInds, side = "right") - 1
+            blockRight = rightRange[rightPositions]
+            blockLeft = firstLeftInds[rightPositions] - (pairInds - pairOffsets[rightPositions])
+            # Keep the fewest points below the line, then the widest line (the first one found).
+            blockScores = self.scoreTangentPairs(xData, yData, blockLeft, blockRight, checkPeakBuffer, maxBadPointsTotal)
+            bestInd = blockScores.argmin()
+            if blockScores[bestInd] < bestScore:
+                bestScore = blockScores[bestInd]
+                bestPair = (int(blockLeft[bestInd]), int(blockRight[bestInd]))
+        
+        # If Nothing Found, Try and Return a Semi-Optimal Tangent Position
+        if bestPair is None:
+            return None, None
+        return bestPair
+    
+    def scoreTangentPairs(self, xData, yData, blockLeft, blockRight, checkPeakBuffer, maxBadPointsTotal):
+        # Score each line: the points below it, then its width (int64 max for the bad lines).
+        numPoints = len(yData)
+        # Get the range of data to check for each pair.
+        blockStartInds = np.maximum(0, blockLeft - checkPeakBuffer)
+        blockEndInds = np.minimum(numPoints, blockRight + 1 + checkPeakBuffer)
+        
+        # Initialize range of data to check
+        firstInd = blockStartInds.min(); lastInd = blockEndInds.max()
+        checkInds = np.arange(firstInd, lastInd)
+        
+        # Draw a Linear Line Between the Points
+        lineSlope = (yData[blockLeft] - yData[blockRight])/(xData[blockLeft] - xData[blockRight])
+        slopeIntercept = yData[blockLeft] - lineSlope*xData[blockLeft]
+        linearFit = np.multiply.outer(lineSlope, xData[firstInd:lastInd])
+        linearFit += slopeIntercept[:, None]
+        
+        # Find the Number of Points Above the Tangent Line (within each pair's window).
+        wrongSide = linearFit > yData[firstInd:lastInd]; del linearFit
+        wrongSide &= blockStartInds[:, None] <= checkInds
+        wrongSide &= checkInds < blockEndInds[:, None]
+        numWrongSideOfTangent = wrongSide.sum(axis = 1)
+        goodPairs = ~(0.1 < numWrongSideOfTangent/(blockEndInds - blockStartInds)) & (numWrongSideOfTangent < maxBadPointsTotal)
+        return np.where(goodPairs, numWrongSideOfTangent*numPoints - (blockRight - blockLeft), np.iinfo(np.int64).max)
+    
+    def findLinearBaseline_Loops(self, xData, yData, peakInd):
         # Define a threshold for distinguishing good/bad lines
         maxBadPointsTotal = int(self.samplingFreq*0.05)
         # Store Possibly Good Tangent Indexes
@@ -186,6 +891,8 @@ class bestLinearFit2:
         # For Each Index Pair on the Left and Right of the Peak
         for rightInd in range(peakInd+2, len(yData), 1):
             for leftInd in range(peakInd-2, -1, -1):
+                if self.pastDeadline():
+                    return None, None
                 if abs(rightInd - leftInd) < self.minPeakDuration:
                     continue
                 
@@ -14,13 +14,17 @@ With a citation:
 
 # Basic Modules
 import math
+import collections
 import numpy as np
 from scipy.linalg import svd
 # Filtering Modules
 import scipy
+import scipy.ndimage
+import scipy.sparse.linalg
 # Fourier Transform Modules
 from scipy.fft import rfft,rfftfreq
 from scipy.fft import irfft
+from scipy.fft import next_fast_len
 
 # -------------------------------------------------------------------------- #
 # ------------------------- Filtering Methods Head ------------------------- #
@@ -39,7 +43,63 @@ class filteringMethods:
 
 class bandPassFilter:
     
-    def butterFilter(self, data, cutoffFreq=[0.1, 7], samplingFreq=800, order=3, filterType='bandpass', fastFilt = True):
+    def __init__(self, maxCachedDesigns = 32):
+        # Cache the designed filters (least recently used designs are forgotten first).
+        self.maxCachedDesigns = maxCachedDesigns
+        self.filterDesigns = collections.OrderedDict()
+    
+    def getFilterDesign(self, designKey, designFilter):
+        """
+        Get a filter design from the cache, designing it with designFilter() if it is not there.
+        """
+        if designKey in self.filterDesigns:
+            # Mark the design as recently used.
+            self.filterDesigns.move_to_end(designKey)
+            return self.filterDesigns[designKey]
+        
+        filterDesign = designFilter()
+        self.filterDesigns[designKey] = filterDesign
+        # Forget the least recently used design if the cache is full.
+        if len(self.filterDesigns) > self.maxCachedDesigns:
+            self.filterDesigns.popitem(last=False)
+        return filterDesign
+    
+    def getButterSOS(self, order, normal_cutoff, filterType):
+        # Design (or reuse) the second-order sections of a Butterworth filter.
+        normal_cutoff = tuple(np.atleast_1d(normal_cutoff).tolist())
+        designKey = ("butter", order, normal_cutoff, filterType)
+        return self.getFilterDesign(designKey, lambda: scipy.signal.butter(order, normal_cutoff if len(normal_cutoff) != 1 else normal_cutoff[0], btype=filterType, analog=False, output='sos'))
+    
+    def getChebyshevSOS(self, Wp, Ws, passband_ripple, stopband_attenuation):
+        # Design (or reuse) the second-order sections of a Chebyshev type I high-pass filter.
+        def designFilter():
+            n, wn = scipy.signal.cheb1ord(Wp, Ws, passband_ripple, stopband_attenuation)
+            return scipy.signal.cheby1(n, passband_ripple, Wp, 'highpass', output='sos')
+        designKey = ("cheby1", float(Wp), float(Ws), passband_ripple, stopband_attenuation, 'highpass')
+        return self.getFilterDesign(designKey, designFilter)
+    
+    def butterFilterStack(self, dataStack, cutoffFreq=[0.1, 7], samplingFreq=800, order=3, filterType='bandpass', axis=-1):
+        """
+        Apply a zero-phase Butterworth filter to a stack of signals in one sosfiltfilt call.
+
+        Parameters
+        ----------
+        dataStack : 2D array-like
+            The signals to filter, all with the same length.
+        axis : int
+            The sample axis of dataStack. Default is -1 (one signal per row).
+        The other parameters are the same as butterFilter.
+
+        Returns
+        -------
+        filteredStack : ndarray
+            The filtered signals, with the same shape as dataStack.
+        """
+        dataStack = np.asarray(dataStack, dtype=float)
+        assert dataStack.ndim == 2, "dataStack must be a 2D stack of signals"
+        return self.butterFilter(dataStack, cutoffFreq, samplingFreq, order, filterType, fastFilt = True, axis = axis)
+    
+    def butterFilter(self, data, cutoffFreq=[0.1, 7], samplingFreq=800, order=3, filterType='bandpass', fastFilt = True, axis = -1):
         """
         Apply a Butterworth filter to a signal.
 
@@ -56,6 +116,8 @@ class bandPassFilter:
             Order of the filter. Default is 3.
         filterType : str
             Type of filter. "low", "high", "bandpass", or "notch". Default is "bandpass".
+        axis : int
+            The axis of data to filter along. Default is -1.
 
         Returns
         -------
@@ -72,15 +134,15 @@ class bandPassFilter:
         normal_cutoff = np.asarray(cutoffFreq) / nyq
         
         if fastFilt:
-            sos = scipy.signal.butter(order, normal_cutoff, btype=filterType, analog=False, output='sos')
-            filteredData = scipy.signal.sosfiltfilt(sos, data)
+            sos = self.getButterSOS(order, normal_cutoff, filterType)
+            filteredData = scipy.signal.sosfiltfilt(sos, data, axis=axis)
         else:
             b, a = scipy.signal.butter(order, normal_cutoff, btype=filterType, analog=False, output='ba')
-            filteredData = scipy.signal.filtfilt(b, a, data)
+            filteredData = scipy.signal.filtfilt(b, a, data, axis=axis)
 
         return filteredData
     
-    def high_pass_filter(self, data_to_filter, sampling_freq, passband_edge, stopband_edge, passband_ripple, stopband_attenuation, fastFilt = True):
+    def high_pass_filter(self, data_to_filter, sampling_freq, passband_edge, stopband_edge, passband_ripple, stopband_attenuation, fastFilt = True, useSOS = False, axis = -1):
         """
         Applies a Chebyshev type I high-pass filter to the input data.
     
@@ -96,6 +158,14 @@ class bandPassFilter:
             Maximum allowed passband ripple in decibels.
         stopband_attenuation : float
             Minimum required stopband attenuation in decibels.
+        fastFilt : bool
+            If True, filter once (causal). Otherwise, filter forwards and backwards (zero-phase).
+        useSOS : bool
+            If True, filter with (cached) second-order sections, which stay stable at higher orders.
+            Otherwise (default), use the transfer function (b, a) coefficients as before. The two
+            differ slightly (about 1e-13, more for high-order designs), so new callers should opt in.
+        axis : int
+            The axis of data_to_filter to filter along. Default is -1.
     
         Returns:
         --------
@@ -110,48 +180,311 @@ class bandPassFilter:
         nyq_freq = 0.5 * sampling_freq
         Wp = passband_edge / nyq_freq
         Ws = stopband_edge / nyq_freq
-        n, wn = scipy.signal.cheb1ord(Wp, Ws, passband_ripple, stopband_attenuation)
+        
+        # Design filter in second-order sections and apply to data
+        if useSOS:
+            sos = self.getChebyshevSOS(Wp, Ws, passband_ripple, stopband_attenuation)
+            if fastFilt:
+                filtered_data = scipy.signal.sosfilt(sos, data_to_filter, axis=axis)
+            else:
+                filtered_data = scipy.signal.sosfiltfilt(sos, data_to_filter, axis=axis)
+            return filtered_data
         
         # Design filter and apply to data
+        n, wn = scipy.signal.cheb1ord(Wp, Ws, passband_ripple, stopband_attenuation)
         bz, az = scipy.signal.cheby1(n, passband_ripple, Wp, 'highpass')
         if fastFilt:
-            filtered_data = scipy.signal.lfilter(bz, az, data_to_filter)
+            filtered_data = scipy.signal.lfilter(bz, az, data_to_filter, axis=axis)
         else:
-            filtered_data = scipy.signal.filtfilt(bz, az, data_to_filter)
+            filtered_data = scipy.signal.filtfilt(bz, az, data_to_filter, axis=axis)
         
         return filtered_data
+    
+    def streamingButterFilter(self, cutoffFreq=[0.1, 7], samplingFreq=800, order=3, filterType='bandpass', lookAhead = 0, initialState = "zero"):
+        """
+        Create a streaming Butterworth filter (see streamingFilter) using the cached filter design.
+        """
+        if filterType == "bandpass" and len(cutoffFreq) != 2:
+            raise ValueError("cutoffFreq must be a list of two frequencies for bandpass or bandstop filters.")
+        normal_cutoff = np.asarray(cutoffFreq) / (0.5 * samplingFreq)
+        
+        return streamingFilter(self.getButterSOS(order, normal_cutoff, filterType), lookAhead, initialState)
 
+class streamingFilter:
+    
+    def __init__(self, sos, lookAhead = 0, initialState = "zero"):
+        """
+        Filter a signal chunk by chunk as it arrives, keeping the filter state (zi) between chunks.
+
+        Parameters
+        ----------
+        sos : ndarray
+            Second-order sections of the filter. Dim: numSections, 6
+        lookAhead : int
+            If 0, filter causally: the output is identical to filtering the whole signal at once with sosfilt.
+            Otherwise, also filter backwards over the last lookAhead samples to approximate the zero-phase
+            (sosfiltfilt) result. Each output sample is then delayed by lookAhead samples.
+        initialState : str
+            "zero" starts the filter at rest (as sosfilt does). "steady" starts it at the steady state of
+            the first sample, which removes the startup transient of signals with an offset.
+        """
+        assert initialState in ["zero", "steady"], "Unknown initial state: " + str(initialState)
+        assert lookAhead >= 0, "lookAhead must be non-negative"
+        self.sos = np.asarray(sos, dtype=float)
+        self.lookAhead = int(lookAhead)
+        self.initialState = initialState
+        # The state of each section after a step of height 1.
+        self.steadyState = scipy.signal.sosfilt_zi(self.sos)
+        
+        self.reset()
+    
+    def reset(self):
+        # Forget the filter state to start a new signal.
+        self.zi = None               # The forward filter state. Dim: numSections, ..., 2
+        self.forwardBuffer = None    # The forward filtered samples that are waiting for their look-ahead.
+    
+    def getSteadyState(self, sample):
+        # The filter state after a long run of the given sample(s). Dim: numSections, ..., 2
+        sample = np.asarray(sample, dtype=float)
+        return self.steadyState.reshape((len(self.sos),) + (1,)*sample.ndim + (2,)) * sample[None, ..., None]
+    
+    def backwardFilter(self, forwardData):
+        # Filter backwards from the newest sample, starting at its steady state.
+        reversedData = forwardData[..., ::-1]
+        backwardData, _ = scipy.signal.sosfilt(self.sos, reversedData, axis=-1, zi=self.getSteadyState(reversedData[..., 0]))
+        return backwardData[..., ::-1]
+    
+    def filterChunk(self, chunk):
+        """
+        Filter the next chunk of the signal.
+
+        Parameters
+        ----------
+        chunk : array-like
+            The new samples. Any size is allowed; the last axis is time (other axes are channels).
+
+        Returns
+        -------
+        filteredChunk : ndarray
+            The filtered samples that are ready. In causal mode, this is every sample in the chunk.
+            In look-ahead mode, the samples lag the input by lookAhead samples (see flush).
+        """
+        chunk = np.asarray(chunk, dtype=float)
+        if chunk.shape[-1] == 0:
+            return chunk
+        
+        # Start the filter state on the first chunk.
+        if self.zi is None:
+            if self.initialState == "steady":
+                self.zi = self.getSteadyState(chunk[..., 0])
+            else:
+                self.zi = np.zeros((len(self.sos),) + chunk.shape[:-1] + (2,))
+        # Filter forwards, continuing from the previous chunk.
+        forwardData, self.zi = scipy.signal.sosfilt(self.sos, chunk, axis=-1, zi=self.zi)
+        if self.lookAhead == 0:
+            return forwardData
+        
+        # Hold the samples until lookAhead newer samples have arrived.
+        if self.forwardBuffer is None:
+            self.forwardBuffer = forwardData
+        else:
+            self.forwardBuffer = np.concatenate((self.forwardBuffer, forwardData), axis=-1)
+        numReady = self.forwardBuffer.shape[-1] - self.lookAhead
+        if numReady <= 0:
+            return self.forwardBuffer[..., :0]
+        
+        # Filter the ready samples backwards, using the look-ahead samples to settle the filter.
+        filteredChunk = self.backwardFilter(self.forwardBuffer)[..., :numReady]
+        self.forwardBuffer = self.forwardBuffer[..., numReady:]
+        return filteredChunk
+    
+    def flush(self):
+        """
+        Return the samples still waiting for their look-ahead (at the end of the signal), and reset the filter.
+        """
+        forwardBuffer = self.forwardBuffer
+        self.reset()
+        
+        if forwardBuffer is None:
+            return np.zeros(0)
+        return self.backwardFilter(forwardBuffer)
     
 # -------------------------------------------------------------------------- #
 # ------------------- Fourier Transform Filtering Methods ------------------ #
 
 class fourierFilter:
     
+    def __init__(self, maxCachedMasks = 32):
+        # Cache the frequency mask of each (padded length, samplingFreq, cutoffFreq).
+        self.maxCachedMasks = maxCachedMasks
+        self.frequencyMasks = {}
+    
     def removeFrequencies(self, f_noise, samplingFreq, cutoffFreq = [0.5, 10]):
-        # Prepend the Data with Zeros to be length 2**N for N = 1,2,3,4...
-        closestPowerOfTwo = 2**(math.ceil(math.log(len(f_noise))/math.log(2)))
-        numZerosToPad = closestPowerOfTwo - len(f_noise)
-        f_noisePadded = [0]*numZerosToPad
-        f_noisePadded.extend(f_noise)
-        # Extra Padding: Mirror the Data on Both Sides
-        f_noisePadded.extend(f_noisePadded[::-1])
+        # Keep the original padding (to a power of two) of a single signal.
+        return self.removeFrequenciesBatch(np.asarray(f_noise, dtype=float)[None, :], samplingFreq, cutoffFreq, paddedLength = "powerOfTwo")[0]
+    
+    def getPaddedLength(self, numPoints, paddedLength = "fast"):
+        # Find the length to pad the data to before it is mirrored.
+        if paddedLength == "powerOfTwo":
+            return 2**(math.ceil(math.log(numPoints)/math.log(2)))
+        
+        # Find the shortest mirrored length (which must be even) that is fast to transform.
+        mirroredLength = next_fast_len(2*numPoints, real=True)
+        while mirroredLength % 2 != 0:
+            mirroredLength = next_fast_len(mirroredLength + 1, real=True)
+        return mirroredLength//2
+    
+    def getFrequencyMask(self, numPoints, samplingFreq, cutoffFreq):
+        # Get the frequencies of the transformed data to keep.
+        maskKey = (numPoints, samplingFreq, tuple(cutoffFreq))
+        if maskKey not in self.frequencyMasks:
+            # Forget the oldest mask if the cache is full.
+            if len(self.frequencyMasks) >= self.maxCachedMasks:
+                self.frequencyMasks.pop(next(iter(self.frequencyMasks)))
+            
+            xf = rfftfreq(numPoints, 1/samplingFreq)
+            self.frequencyMasks[maskKey] = np.logical_and(cutoffFreq[0] < xf, xf < cutoffFreq[1])
+        return self.frequencyMasks[maskKey]
+    
+    def removeFrequenciesBatch(self, signals, samplingFreq, cutoffFreq = [0.5, 10], axis = -1, workers = None, paddedLength = "fast"):
+        """
+        Remove the frequencies outside the cutoff range from a stack of signals.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            signals: The signals to filter, with time along the given axis. Dim: ..., numPoints, ...
+            samplingFreq: The sampling frequency of the signals.
+            cutoffFreq: The [lowest, highest] frequency to keep.
+            axis: The sample axis of signals.
+            workers: The number of threads used by the FFT (None uses one; -1 uses all the CPUs).
+            paddedLength: "fast" pads the signals to a length that is fast to transform (next_fast_len);
+                "powerOfTwo" pads them to the next power of two, as removeFrequencies always did.
+        Output Variable Definitions:
+            filteredSignals: The filtered signals. Dim: signals.shape
+        --------------------------------------------------------------------------
+        """
+        assert paddedLength in ["fast", "powerOfTwo"], "Unknown padded length: " + str(paddedLength)
+        signals = np.moveaxis(np.asarray(signals, dtype=float), axis, -1)
+        numPoints = signals.shape[-1]
+        
+        # Prepend the Data with Zeros, then Mirror the Data
+        halfLength = self.getPaddedLength(numPoints, paddedLength)
+        numZerosToPad = halfLength - numPoints
+        signalsPadded = np.zeros(signals.shape[:-1] + (2*halfLength,))
+        signalsPadded[..., numZerosToPad:halfLength] = signals
+        signalsPadded[..., halfLength:2*halfLength - numZerosToPad] = signals[..., ::-1]
+        
         # Tranform the Data into the Frequency Domain
-        n    = len(f_noisePadded)
-        yf   = rfft(f_noisePadded)
-        xf   = rfftfreq(n, 1/samplingFreq)
+        yf = rfft(signalsPadded, axis=-1, workers=workers)
         # Remove the Frequencies Outside the Range
-        indices     = np.logical_and(cutoffFreq[0] < xf, xf < cutoffFreq[1])
-        yf_clean    = indices * yf # noise frequency will be set to 0
+        yf *= self.getFrequencyMask(2*halfLength, samplingFreq, cutoffFreq)
         # Reconstruct the Signal and Return the Data
-        return irfft(yf_clean)[numZerosToPad:numZerosToPad+len(f_noise)]
+        filteredSignals = irfft(yf, n=2*halfLength, axis=-1, workers=workers)[..., numZerosToPad:halfLength]
+        
+        return np.moveaxis(filteredSignals, -1, axis)
 
 # -------------------------------------------------------------------------- #
 # ------------------------ Savgol Filtering Methods ------------------------ #
 
 class savgolFilter:
     
-    def savgolFilter(self, noisyData, window_length, polyorder, deriv = 0, mode='nearest'):
-        return scipy.signal.savgol_filter(noisyData, window_length, polyorder, deriv = deriv)
+    def __init__(self, maxCachedKernels = 32):
+        # Cache the filter coefficients of each (window_length, polyorder, deriv).
+        self.maxCachedKernels = maxCachedKernels
+        self.savgolKernels = {}
+        self.edgeBases = {}
+    
+    def savgolFilter(self, noisyData, window_length, polyorder, deriv = 0, mode='interp', axis = -1):
+        return self.savgolDerivatives(noisyData, window_length, polyorder, [deriv], mode, axis)[0]
+    
+    def getSavgolKernel(self, window_length, polyorder, deriv):
+        # Get the coefficients of one Savitzky-Golay filter.
+        kernelKey = (window_length, polyorder, deriv)
+        if kernelKey not in self.savgolKernels:
+            # Forget the oldest kernel if the cache is full.
+            if len(self.savgolKernels) >= self.maxCachedKernels:
+                self.savgolKernels.pop(next(iter(self.savgolKernels)))
+            
+            # The coefficients to convolve with the data.
+            self.savgolKernels[kernelKey] = scipy.signal.savgol_coeffs(window_length, polyorder, deriv = deriv)
+        return self.savgolKernels[kernelKey]
+    
+    def getEdgeBasis(self, window_length, polyorder):
+        # Get the (column scaled) polynomial basis fit to the window at each edge ("interp" mode).
+        basisKey = (window_length, polyorder)
+        if basisKey not in self.edgeBases:
+            # Forget the oldest basis if the cache is full.
+            if len(self.edgeBases) >= self.maxCachedKernels:
+                self.edgeBases.pop(next(iter(self.edgeBases)))
+            
+            # Build the same scaled Vandermonde matrix as np.polyfit.
+            windowPoints = np.arange(window_length, dtype=float)
+            edgeBasis = windowPoints[:, None] ** np.arange(polyorder, -1, -1, dtype=float)[None, :]
+            basisScale = np.sqrt(np.sum(edgeBasis*edgeBasis, axis=0))
+            edgeBasis /= basisScale
+            
+            self.edgeBases[basisKey] = (edgeBasis, basisScale)
+        return self.edgeBases[basisKey]
+    
+    def fitEdges(self, noisyData, filteredData, window_length, polyorder, derivs):
+        """
+        Replace the edges of each filtered signal with the polynomial fit to the first/last window of data.
+        The fit is shared by every derivative, and is found for all the signals at once.
+        """
+        edgeBasis, basisScale = self.getEdgeBasis(window_length, polyorder)
+        numPoints = noisyData.shape[-1]; halfWindow = window_length//2
+        
+        for windowStart, interpStart in [(0, 0), (numPoints - window_length, numPoints - halfWindow)]:
+            # Fit a polynomial to the window of every signal.
+            edgeData = noisyData[..., windowStart:windowStart + window_length].reshape(-1, window_length).T
+            polyCoeffs = scipy.linalg.lstsq(edgeBasis, edgeData, cond = window_length*np.finfo(float).eps)[0]
+            polyCoeffs = (polyCoeffs.T / basisScale).T
+            edgePoints = np.arange(interpStart - windowStart, interpStart - windowStart + halfWindow, dtype=float)[:, None]
+            
+            for derivInd, deriv in enumerate(derivs):
+                # Differentiate the polynomial.
+                derivCoeffs = polyCoeffs[:len(polyCoeffs) - deriv].copy() if deriv < len(polyCoeffs) else np.zeros_like(polyCoeffs[:1])
+                if deriv < len(polyCoeffs):
+                    for derivOrder in range(deriv):
+                        derivCoeffs *= np.arange(len(polyCoeffs) - derivOrder - 1, deriv - derivOrder - 1, -1, dtype=float)[:, None]
+                
+                # Evaluate the polynomial at the edge points (Horner's method).
+                edgeValues = np.zeros((halfWindow, edgeData.shape[1]))
+                for polyCoeff in derivCoeffs:
+                    edgeValues = edgeValues*edgePoints + polyCoeff
+                filteredData[derivInd, ..., interpStart:interpStart + halfWindow] = edgeValues.T.reshape(noisyData.shape[:-1] + (halfWindow,))
+        
+        return filteredData
+    
+    def savgolDerivatives(self, noisyData, window_length, polyorder, derivs = [0, 1], mode = 'interp', axis = -1):
+        """
+        Smooth the data and take its derivatives in one call, reusing the cached coefficients.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            noisyData: The data to filter. The filter is applied along the given axis. Dim: ..., numPoints, ...
+            window_length: The (odd) number of points in each polynomial fit.
+            polyorder: The order of the polynomial fit.
+            derivs: The derivatives to return (0 is the smoothed data).
+            mode: How to handle the edges: "interp" (scipy's default), "mirror", "nearest", "wrap", or "constant".
+            axis: The axis to filter along.
+        Output Variable Definitions:
+            filteredData: The filtered data for each derivative. Dim: len(derivs), noisyData.shape
+        --------------------------------------------------------------------------
+        """
+        assert mode in ["interp", "mirror", "nearest", "wrap", "constant"], "Unknown savgol mode: " + str(mode)
+        noisyData = np.moveaxis(np.asarray(noisyData, dtype=float), axis, -1)
+        if mode == "interp" and window_length > noisyData.shape[-1]:
+            raise ValueError("If mode is 'interp', window_length must be less than or equal to the size of the data.")
+        
+        # Convolve the whole stack at once (the same convolution as scipy.signal.savgol_filter).
+        filteredData = np.empty((len(derivs),) + noisyData.shape)
+        for derivInd, deriv in enumerate(derivs):
+            filteredData[derivInd] = scipy.ndimage.convolve1d(noisyData, self.getSavgolKernel(window_length, polyorder, deriv), axis=-1, mode="constant" if mode == "interp" else mode)
+        # Fit the edges once for all the derivatives.
+        if mode == "interp":
+            filteredData = self.fitEdges(noisyData, filteredData, window_length, polyorder, derivs)
+        
+        # Put the filtered axis back in place.
+        return np.moveaxis(filteredData, -1, axis if axis < 0 else axis + 1)
     
 # -------------------------------------------------------------------------- #
 # -------------------------- SVD Filtering Methods ------------------------- #
@@ -165,15 +498,17 @@ class Denoiser:
             Code running mode: "layman" or "expert".
             In the "layman" mode, the code autonomously tries to find the optimal denoised sequence.
             In the "expert" mode, a user has full control over it.
+        engine: str
+            SVD engine: "full", "truncated", or "gram".
         s: 1D array of floats
-            Singular values ordered decreasingly.
+            Singular values ordered decreasingly. The "truncated" engine only keeps the leading ones.
         U: 2D array of floats
             A set of left singular vectors as the columns.
         r: int
             Rank of the approximating matrix of the constructed partial circulant matrix from the sequence.
     '''
 
-    def __init__(self, mode="program"):
+    def __init__(self, mode="program", engine="full", max_truncated_fraction=0.25):
         '''
         Class initialization.
         -----
@@ -181,15 +516,33 @@ class Denoiser:
             mode: str
                 Denoising mode. To be selected from ["layman", "expert", "program"]. Default is "program".
                 While "layman" grants the code autonomy, "expert" allows a user to experiment.
+            engine: str
+                SVD engine. To be selected from ["full", "truncated", "gram"]. Default is "full".
+                "truncated" only finds the leading singular components (Lanczos iteration), adding more
+                until the first noise component is found. Its products with the circulant matrix are FFT
+                correlations, so it is much faster for long sequences when the rank is far below the layer.
+                "gram" eigendecomposes the (layer, layer) Gram matrix of the circulant matrix, which is the
+                cyclic autocorrelation of the sequence (by FFT). Its memory is bounded by layer**2 instead of layer*n.
+            max_truncated_fraction: float
+                The "truncated" engine falls back to a full SVD once it needs more than this fraction of the components.
+                Must be between 0 and 1 (exclusive).
         -----
         Raises:
             ValueError
-                If mode is neither "layman" nor "expert".
+                If mode is neither "layman" nor "expert", the engine is unknown, or max_truncated_fraction is not in (0, 1).
         '''
         self._method = {"program": self._denoise_for_consistency, "layman": self._denoise_for_layman, "expert": self._denoise_for_expert}
         if mode not in self._method:
             raise ValueError("unknown mode '{:s}'!".format(mode))
+        if engine not in ["full", "truncated", "gram"]:
+            raise ValueError("unknown engine '{:s}'!".format(engine))
+        if not 0 < max_truncated_fraction < 1:
+            raise ValueError("max_truncated_fraction must be between 0 and 1, not {}!".format(max_truncated_fraction))
         self.mode = mode
+        self.engine = engine
+        self.max_truncated_fraction = max_truncated_fraction
+        # relative accuracy of the singular values found by the "truncated" engine
+        self.tolerance = 1E-10
 
     def _embed(self, x, m):
         '''
@@ -229,6 +582,30 @@ class Denoiser:
         a = np.mean(np.lib.stride_tricks.as_strided(A_ext[:,m-1:], A.shape, strides), axis=0)
         return a
 
+    def _reduce_factors(self, U, s, Vh):
+        '''
+        Reduce the low-rank matrix A = U @ diag(s) @ Vh to a 1D array by cyclic anti-diagonal average, without forming A.
+        The average is a[j] = mean_i A[i,(j-i)%n] = sum_k s[k] (U[:,k] * Vh[k])[j] / m, a cyclic convolution of each pair
+        of singular vectors, which is summed in the frequency domain.
+        -----
+        Arguments:
+            U: 2D array of floats
+                Left singular vectors as the columns. Dim: m, rank
+            s: 1D array of floats
+                Singular values. Dim: rank
+            Vh: 2D array of floats
+                Right singular vectors as the rows. Dim: rank, n
+        -----
+        Returns:
+            a: 1D array of floats
+                Output array. Same as self._reduce(U @ np.diag(s) @ Vh).
+        '''
+        m, n = U.shape[0], Vh.shape[1]
+        # convolve each pair of singular vectors (U is zero padded to length n)
+        a_fft = np.sum(s * rfft(U, n, axis=0) * rfft(Vh.T, axis=0), axis=1)
+        a = irfft(a_fft, n) / m
+        return a
+
     def _denoise_for_expert(self, sequence, layer, gap, rank):
         '''
         Smooth a noisy sequence by means of low-rank approximation of its corresponding partial circulant matrix.
@@ -256,14 +633,208 @@ class Denoiser:
         self.r = rank
         # linear trend to be deducted
         trend = np.linspace(0, gap, sequence.size)
-        X = self._embed(sequence-trend, layer)
         # singular value decomposition
-        self.U, self.s, Vh = svd(X, full_matrices=False, overwrite_a=True, check_finite=False)
+        self.U, self.s, Vh = self._leading_svd(sequence-trend, layer, self.r)
         # low-rank approximation
-        A = self.U[:,:self.r] @ np.diag(self.s[:self.r]) @ Vh[:self.r]
-        denoised = self._reduce(A) + trend
+        denoised = self._reduce_factors(self.U[:,:self.r], self.s[:self.r], Vh[:self.r]) + trend
         return denoised
 
+    def _search_rank(self, U, complete):
+        '''
+        Search for the first noise component among the left singular vectors.
+        -----
+        Arguments:
+            U: 2D array of floats
+                The leading left singular vectors as the columns.
+            complete: bool
+                True if U holds every left singular vector.
+        -----
+        Returns:
+            r: int or None
+                Index of the first noise component. None if U ran out of columns before one was found.
+        '''
+        # Search for noise components using the normalized mean total variation of the left singular vectors as an indicator.
+        # The procedure runs in batch of every 10 singular vectors.
+        r = 0
+        while True:
+            # more singular vectors are needed to check the next batch
+            if not complete and r+10 > U.shape[1]:
+                return None
+            U_sub = U[:,r:r+10]
+            NMTV = np.mean(np.abs(np.diff(U_sub,axis=0)), axis=0) / (np.amax(U_sub,axis=0) - np.amin(U_sub,axis=0))
+            try:
+                # the threshold of 10% can in most cases discriminate noise components
+                r += np.argwhere(NMTV > .1)[0,0]
+                return r
+            except IndexError:
+                r += 10
+
+    def _circulant_operator(self, x, m):
+        '''
+        Represent the partial circulant matrix of a 1D array as a linear operator, without building it.
+        Products with the matrix (and its transpose) are cyclic cross-correlations, computed by FFT in O(n log n).
+        -----
+        Arguments:
+            x: 1D array of floats
+                Input array.
+            m: int
+                Number of rows of the constructed matrix.
+        -----
+        Returns:
+            X: LinearOperator
+                Operator acting as the (m, x.size) partial circulant matrix.
+        '''
+        n = x.size
+        x_fft = rfft(x)
+        def matmat(V):
+            # (X @ V)[i] = sum_j x[(i+j) % n] V[j]
+            return irfft(x_fft.reshape((-1,)+(1,)*(V.ndim-1)) * np.conj(rfft(V, axis=0)), n, axis=0)[:m]
+        def rmatmat(U):
+            # (X.T @ U)[j] = sum_i x[(i+j) % n] U[i], the same correlation with U padded to length n
+            U_padded = np.zeros((n,)+U.shape[1:])
+            U_padded[:m] = U
+            return irfft(x_fft.reshape((-1,)+(1,)*(U.ndim-1)) * np.conj(rfft(U_padded, axis=0)), n, axis=0)
+        return scipy.sparse.linalg.LinearOperator((m, n), matvec=matmat, rmatvec=rmatmat, matmat=matmat, rmatmat=rmatmat, dtype=float)
+
+    def _gram_eigh(self, x, m):
+        '''
+        Find the left singular vectors and singular values of the partial circulant matrix of x from its Gram matrix.
+        The Gram matrix X @ X.T is the symmetric Toeplitz matrix of the cyclic autocorrelation of x.
+        -----
+        Arguments:
+            x: 1D array of floats
+                Input array.
+            m: int
+                Number of rows of the constructed matrix.
+        -----
+        Returns:
+            U, s: 2D, 1D arrays of floats
+                Every left singular vector (as the columns) and singular value, ordered decreasingly.
+        '''
+        # cyclic autocorrelation of x: R[l] = sum_j x[j] x[(j+l) % n]
+        x_fft = rfft(x)
+        autocorrelation = irfft(np.abs(x_fft)**2, x.size)
+        # eigendecomposition of the (m, m) Gram matrix
+        eigenvalues, U = scipy.linalg.eigh(scipy.linalg.toeplitz(autocorrelation[:m]), check_finite=False)
+        # order the components decreasingly
+        s = np.sqrt(np.clip(eigenvalues[::-1], 0, None))
+        return U[:,::-1], s
+
+    def _right_singular_vectors(self, x, m, U, s):
+        '''
+        Find the right singular vectors matching the given left singular vectors: Vh = diag(1/s) @ U.T @ X.
+        -----
+        Arguments:
+            x: 1D array of floats
+                Input array.
+            m: int
+                Number of rows of the constructed matrix.
+            U, s: 2D, 1D arrays of floats
+                Left singular vectors (as the columns) and singular values.
+        -----
+        Returns:
+            Vh: 2D array of floats
+                Right singular vectors as the rows.
+        '''
+        Vh = self._circulant_operator(x, m).rmatmat(U).T
+        return Vh / np.where(s > 0, s, 1)[:,None]
+
+    def _leading_svd(self, x, m, k):
+        '''
+        Find (at least) the k leading singular components of the partial circulant matrix of x with the selected engine.
+        -----
+        Arguments:
+            x: 1D array of floats
+                Input array.
+            m: int
+                Number of rows of the constructed matrix.
+            k: int
+                Number of leading components needed.
+        -----
+        Returns:
+            U, s, Vh: 2D, 1D, 2D arrays of floats
+                Leading singular components, ordered decreasingly. A full SVD returns every component.
+        '''
+        if self.engine == "gram":
+            U, s = self._gram_eigh(x, m)
+            return U, s, self._right_singular_vectors(x, m, U[:,:k], s[:k])
+        # a full SVD is used when many of the components are needed (ARPACK needs k < min(m, n))
+        if self.engine == "truncated" and k <= self.max_truncated_fraction*m and k < min(m, x.size):
+            try:
+                # Lanczos iteration (ARPACK), from a fixed starting vector for repeatable results
+                v0 = np.random.default_rng(0).standard_normal(min(m, x.size))
+                U, s, Vh = scipy.sparse.linalg.svds(self._circulant_operator(x, m), k=k, tol=self.tolerance, v0=v0, solver="arpack")
+                order = np.argsort(s)[::-1]
+                return U[:,order], s[order], Vh[order]
+            except scipy.sparse.linalg.ArpackNoConvergence:
+                pass
+        # fall back to a full SVD
+        return svd(self._embed(x, m), full_matrices=False, overwrite_a=True, check_finite=False)
+
+    def _truncated_rank_search(self, x, m):
+        '''
+        Find the leading singular components of the partial circulant matrix of x, adding more until the first noise component is found.
+        -----
+        Arguments:
+            x: 1D array of floats
+                Input array.
+            m: int
+                Number of rows of the constructed matrix.
+        -----
+        Returns:
+            U, s, Vh: 2D, 1D, 2D arrays of floats
+                Leading singular components, ordered decreasingly.
+            r: int
+                Index of the first noise component.
+        '''
+        num_components = min(m, x.size)
+        k = min(20, num_components)
+        while True:
+            U, s, Vh = self._leading_svd(x, m, k)
+            r = self._search_rank(U, complete=(len(s) == num_components))
+            if r is not None:
+                return U, s, Vh, r
+            # double the number of components and try again (every component is a full SVD)
+            k = min(2*k, num_components)
+
+    def _signal_components(self, x, m):
+        '''
+        Decompose the partial circulant matrix of x with the selected engine and split the signal components from the noise.
+        Nothing is stored on the instance.
+        -----
+        Arguments:
+            x: 1D array of floats
+                Input array.
+            m: int
+                Number of rows of the constructed matrix.
+        -----
+        Returns:
+            U, s, Vh: 2D, 1D, 2D arrays of floats
+                Singular components, ordered decreasingly ("truncated" only keeps the leading ones, "gram" only the right singular vectors of the signal).
+            r: int
+                Index of the first noise component.
+            noise_stdev: float
+                Estimated noise strength.
+        '''
+        if self.engine == "truncated":
+            U, s, Vh, r = self._truncated_rank_search(x, m)
+            # estimate the noise strength from the energy left after the signal components.
+            # Every row of X is a cyclic shift of x, so the total energy is m*sum(x**2).
+            noise_stdev = np.sqrt(max(m*np.sum(x**2) - np.sum(s[:r]**2), 0) / (m*x.size))
+        elif self.engine == "gram":
+            U, s = self._gram_eigh(x, m)
+            r = self._search_rank(U, complete=True)
+            # only the right singular vectors of the signal components are needed
+            Vh = self._right_singular_vectors(x, m, U[:,:r], s[:r])
+            noise_stdev = np.sqrt(np.sum(s[r:]**2) / (m*x.size))
+        else:
+            X = self._embed(x, m)
+            U, s, Vh = svd(X, full_matrices=False, overwrite_a=True, check_finite=False)
+            r = self._search_rank(U, complete=True)
+            # estimate the noise strength, while r marks the first noise component
+            noise_stdev = np.sqrt(np.sum(s[r:]**2) / X.size)
+        return U, s, Vh, r, noise_stdev
+
     def _cross_validate(self, x, m):
         '''
         Check if the gap of boundary levels of the detrended sequence is within the estimated noise strength.
@@ -278,22 +849,7 @@ class Denoiser:
             valid: bool
                 Result of cross validation. True means the detrending procedure is valid.
         '''
-        X = self._embed(x, m)
-        self.U, self.s, self._Vh = svd(X, full_matrices=False, overwrite_a=True, check_finite=False)
-        # Search for noise components using the normalized mean total variation of the left singular vectors as an indicator.
-        # The procedure runs in batch of every 10 singular vectors.
-        self.r = 0
-        while True:
-            U_sub = self.U[:,self.r:self.r+10]
-            NMTV = np.mean(np.abs(np.diff(U_sub,axis=0)), axis=0) / (np.amax(U_sub,axis=0) - np.amin(U_sub,axis=0))
-            try:
-                # the threshold of 10% can in most cases discriminate noise components
-                self.r += np.argwhere(NMTV > .1)[0,0]
-                break
-            except IndexError:
-                self.r += 10
-        # estimate the noise strength, while r marks the first noise component
-        noise_stdev = np.sqrt(np.sum(self.s[self.r:]**2) / X.size)
+        self.U, self.s, self._Vh, self.r, noise_stdev = self._signal_components(x, m)
         # estimate the gap of boundary levels after detrend
         gap = np.abs(x[-self._k:].mean()-x[:self._k].mean())
         valid = gap < noise_stdev
@@ -329,8 +885,7 @@ class Denoiser:
             self._k -= 2
             trend = np.linspace(0, sequence[-self._k:].mean()-sequence[:self._k].mean(), sequence.size)
         # low-rank approximation by using only signal components
-        A = self.U[:,:self.r] @ np.diag(self.s[:self.r]) @ self._Vh[:self.r]
-        denoised = self._reduce(A) + trend
+        denoised = self._reduce_factors(self.U[:,:self.r], self.s[:self.r], self._Vh[:self.r]) + trend
         return denoised
     
     
@@ -361,8 +916,7 @@ class Denoiser:
         self._cross_validate(sequence-trend, layer)
 
         # low-rank approximation by using only signal components
-        A = self.U[:,:self.r] @ np.diag(self.s[:self.r]) @ self._Vh[:self.r]
-        denoised = self._reduce(A) + trend
+        denoised = self._reduce_factors(self.U[:,:self.r], self.s[:self.r], self._Vh[:self.r]) + trend
         return denoised
     
     def _denoise_for_consisten1cy(self, sequence, layer, k = 11, r = 20):
@@ -391,12 +945,10 @@ class Denoiser:
         trend = np.linspace(0, sequence[-self._k:].mean()-sequence[:self._k].mean(), sequence.size)
         
         # Cross Validate
-        X = self._embed(sequence - trend, layer)
-        self.U, self.s, self._Vh = svd(X, full_matrices=False, overwrite_a=True, check_finite=False)
+        self.U, self.s, self._Vh = self._leading_svd(sequence - trend, layer, self.r)
 
         # low-rank approximation by using only signal components
-        A = self.U[:,:self.r] @ np.diag(self.s[:self.r]) @ self._Vh[:self.r]
-        denoised = self._reduce(A) + trend
+        denoised = self._reduce_factors(self.U[:,:self.r], self.s[:self.r], self._Vh[:self.r]) + trend
         return denoised
 
     def denoise(self, *args, **kwargs):
@@ -406,6 +958,95 @@ class Denoiser:
         '''
         return self._method[self.mode](*args, **kwargs)
 
+    def denoise_batch(self, sequences, layer, k = 20, max_memory = 256*1024**2):
+        '''
+        Stateless version of the "program" method for a stack of sequences. Nothing is stored on the instance,
+        so one Denoiser can be shared across threads. The "full" engine decomposes many sequences at once
+        (stacked SVD); the "truncated" and "gram" engines decompose one sequence at a time, as in denoise.
+        -----
+        Arguments:
+            sequences: 2D array of floats
+                Data sequences to be denoised, one per row (all the same length).
+            layer: int
+                Number of leading rows selected from the corresponding circulant matrices.
+            k: int
+                Number of neighboring data averaged to estimate the boundary levels of each sequence.
+            max_memory: int
+                Maximum memory (bytes) of the circulant matrices decomposed at once by the stacked SVD ("full" engine).
+        -----
+        Returns:
+            result: denoiseResult
+                The denoised sequences along with the rank and noise strength of each one.
+        -----
+        Raises:
+            AssertionError
+                If condition 1 <= layer <= sequence.size cannot be fulfilled.
+        '''
+        sequences = np.atleast_2d(np.asarray(sequences, dtype=float))
+        num_sequences, n = sequences.shape
+        assert 1 <= layer <= n
+        # remove the linear inclination between the boundary levels of each sequence
+        gaps = sequences[:,-k:].mean(axis=1) - sequences[:,:k].mean(axis=1)
+        trends = np.linspace(0, gaps, n, axis=-1)
+        detrended = sequences - trends
+        
+        denoised = np.empty_like(sequences)
+        ranks = np.empty(num_sequences, dtype=int)
+        noise_stdevs = np.empty(num_sequences)
+        singular_values = np.empty((num_sequences, min(layer, n)))
+        # the other engines decompose each sequence on its own
+        if self.engine != "full":
+            singular_values.fill(np.nan)
+            for row in range(num_sequences):
+                U, s, Vh, r, noise_stdevs[row] = self._signal_components(detrended[row], layer)
+                ranks[row] = r
+                denoised[row] = self._reduce_factors(U[:,:r], s[:r], Vh[:r]) + trends[row]
+                singular_values[row,:len(s)] = s
+            return denoiseResult(denoised, ranks, noise_stdevs, singular_values)
+        
+        # decompose as many circulant matrices at once as the memory allows
+        batch_size = max(1, int(max_memory // (8*layer*n)))
+        for start in range(0, num_sequences, batch_size):
+            x = detrended[start:start+batch_size]
+            # embed each sequence into its partial circulant matrix (stacked)
+            x_ext = np.hstack((x, x[:,:layer-1]))
+            X = np.lib.stride_tricks.sliding_window_view(x_ext, n, axis=-1)[:,:layer]
+            U, s, Vh = np.linalg.svd(X, full_matrices=False)
+            
+            for row in range(len(x)):
+                # search for the first noise component and estimate the noise strength
+                r = self._search_rank(U[row], complete=True)
+                ranks[start+row] = r
+                noise_stdevs[start+row] = np.sqrt(np.sum(s[row,r:]**2) / X[row].size)
+                # low-rank approximation by using only signal components
+                denoised[start+row] = self._reduce_factors(U[row,:,:r], s[row,:r], Vh[row,:r]) + trends[start+row]
+            singular_values[start:start+len(x)] = s
+        
+        return denoiseResult(denoised, ranks, noise_stdevs, singular_values)
+
+
+class denoiseResult:
+    '''
+    The result of denoising a stack of sequences with Denoiser.denoise_batch.
+    -----
+    Attributes:
+        denoised: 2D array of floats
+            Smoothed sequences after denoise, one per row.
+        rank: 1D array of ints
+            Rank of the approximating matrix of each sequence (the index of its first noise component).
+        noise_stdev: 1D array of floats
+            Estimated noise strength of each sequence.
+        s: 2D array of floats
+            Singular values of each sequence's partial circulant matrix, ordered decreasingly.
+            The "truncated" engine only finds the leading ones: the rest are NaN.
+    '''
+
+    def __init__(self, denoised, rank, noise_stdev, s):
+        self.denoised = denoised
+        self.rank = rank
+        self.noise_stdev = noise_stdev
+        self.s = s
+
 
 if __name__ == "__main__":
     x = np.linspace(-10, 10, 1000)
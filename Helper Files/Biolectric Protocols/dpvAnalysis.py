@@ -3,7 +3,10 @@
 # ---------------------------- Imported Modules ---------------------------- #
 
 # General
+import time
 import scipy
+import warnings
+import numpy as np
 
 # Import filtering file
 import _baselineProtocols   # Import class with baseline methods.
@@ -14,18 +17,22 @@ import _filteringProtocols  # Import class with filtering methods.
 
 class dpvProtocols:
     
+    # The characteristics of each peak (see characterizePeaks).
+    peakInfoType = np.dtype([("index", int), ("potential", float), ("height", float), ("prominence", float), ("fwhm", float), ("area", float)])
+    
     def __init__(self):
         # Initialize general data preperation classes.
         self.filteringMethods = _filteringProtocols.filteringMethods()
         
         # Initialize baseline subtraction classes.
-        self.linearBaselineFit = _baselineProtocols.bestLinearFit2()
+        self.linearBaselineFit = _baselineProtocols.bestLinearFit2(savgolFilter = self.filteringMethods.savgolFilter)
         self.polynomialBaselineFit = _baselineProtocols.polynomialBaselineFit()
+        self.leastSquaresBaselineFit = _baselineProtocols.asymmetricLeastSquares()
     
     def findReductiveScale_CV(self, current, potential):
         # Calculate the first derivative
         samplingFreq = abs(len(potential)/(potential[-1] - potential[0]))
-        firstDeriv = scipy.signal.savgol_filter(current, self.convert_to_odd(int(samplingFreq*0.1)), 3, deriv = 1)
+        firstDeriv = self.filteringMethods.savgolFilter.savgolFilter(current, self.convert_to_odd(int(samplingFreq*0.1)), 3, deriv = 1)
         
         # See if the first derivative of the initial points are positive or negative.
         initialScanDeriv = firstDeriv[0:int(samplingFreq*0.1)]
@@ -55,10 +62,38 @@ class dpvProtocols:
         reductiveScale = self.findReductiveScale(current)
         
         # Get Baseline from Iterative Polynomial Subtraction
-        baseline = self.polynomialBaselineFit.baselineSubtractionAPI(current, polynomialOrder, reductiveScale)
+        baseline = self.polynomialBaselineFit.baselineSubtractionAPI(current, polynomialOrder, reductiveScale, potential)
         # Find Current After Baseline Subtraction
         baselineCurrent = current - baseline
         
+        peakIndices = self.findPolynomialPeaks(potential, baselineCurrent)
+        
+        return baseline, baselineCurrent, peakIndices
+    
+    def useBaselineSubtraction_Batch(self, currents, potential, polynomialOrder):
+        """
+        Apply useBaselineSubtraction to a stack of curves sharing one potential (Dim: numCurves, numScanPoints).
+        The number of ModPoly iterations of each curve is stored in self.polynomialBaselineFit.numIterations.
+        If polynomialOrder is "auto", the order and score of each curve are in self.polynomialBaselineFit.bestOrders/orderScores.
+        """
+        startTime = time.time()
+        currents = np.asarray(currents, dtype=float)
+        # Check if each curve is oxidative or reductive.
+        reductiveScales = np.where((currents < 0).sum(axis=1) > currents.shape[1]/2, -1, 1)[:, None]
+        
+        # Get the baselines of all the curves at once.
+        baselines = self.polynomialBaselineFit.modPoly(currents*reductiveScales, polynomialOrder, potential)*reductiveScales
+        # Find Current After Baseline Subtraction
+        baselineCurrents = currents - baselines
+        allPeakIndices = [self.findPolynomialPeaks(potential, baselineCurrent) for baselineCurrent in baselineCurrents]
+        
+        # Report the throughput.
+        analysisTime = time.time() - startTime
+        print(f"\tFound the baselines of {len(currents)} curves in {analysisTime:.2f} s ({len(currents)/max(analysisTime, 1E-9):.1f} curves/second)")
+        
+        return baselines, baselineCurrents, allPeakIndices
+    
+    def findPolynomialPeaks(self, potential, baselineCurrent):
         smoothCurrent = scipy.interpolate.UnivariateSpline(potential, baselineCurrent, s=0.001, k=5)
         smoothCurrentPeaks = scipy.signal.find_peaks(smoothCurrent.derivative(n=1)(potential), prominence=10E-10)
         
@@ -69,17 +104,176 @@ class dpvProtocols:
         else:
             peakIndices = [];
         
-        return baseline, baselineCurrent, peakIndices
+        return peakIndices
             
-    def useLinearFit(self, current, potential):
+    def useLinearFit(self, current, potential, rawCurrent = None):
         # Check if the data is oxidative or reductive.
         reductiveScale = self.findReductiveScale(current)
         
-        # Remove the baseline from the data
-        baseline = self.linearBaselineFit.findBaseline(potential, current*reductiveScale)*reductiveScale
+        # Remove the baseline from the data (the unfiltered current gives the noise level).
+        rawCurrent = None if rawCurrent is None else np.asarray(rawCurrent)*reductiveScale
+        baseline, self.baselineIndCuts = self.linearBaselineFit.findBaseline(potential, current*reductiveScale, rawData = rawCurrent)
+        baseline = baseline*reductiveScale
+        baselineCurrent = current - baseline
+        # Find the Peak Current After Baseline Subtraction
+        peakIndices = self.linearBaselineFit.findPeakGeneral(potential, baselineCurrent*reductiveScale)
+        
+        return baseline, baselineCurrent, peakIndices
+        
+    
+    def useAsymmetricLeastSquares(self, current, potential):
+        # Check if the data is oxidative or reductive.
+        reductiveScale = self.findReductiveScale(current)
+        
+        # Get the smooth baseline under the peaks.
+        baseline = self.leastSquaresBaselineFit.getBaseline(potential, current*reductiveScale)*reductiveScale
         baselineCurrent = current - baseline
         # Find the Peak Current After Baseline Subtraction
+        self.linearBaselineFit.setSamplingFreq(potential)
         peakIndices = self.linearBaselineFit.findPeakGeneral(potential, baselineCurrent*reductiveScale)
         
         return baseline, baselineCurrent, peakIndices
+    
+    def useLinearFit_Batch(self, currents, potential, rawCurrents = None):
+        """
+        Apply useLinearFit to a stack of curves sharing one potential.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            currents: The (filtered) current of each curve. Dim: numCurves, numScanPoints
+            potential: The potential shared by all the curves. Dim: numScanPoints
+            rawCurrents: The unfiltered current of each curve, used to estimate the noise. Dim: numCurves, numScanPoints
+        Output Variable Definitions:
+            baselines: The baseline of each curve. Dim: numCurves, numScanPoints
+            baselineCurrents: The baseline subtracted current of each curve. Dim: numCurves, numScanPoints
+            allPeakIndices: A list of the peak indices of each curve. Dim: numCurves, numPeaks
+        The baseline segment boundaries of each curve are stored in self.allBaselineIndCuts.
+        --------------------------------------------------------------------------
+        """
+        startTime = time.time()
+        currents = np.asarray(currents, dtype=float)
+        # Check if each curve is oxidative or reductive.
+        reductiveScales = np.where((currents < 0).sum(axis=1) > currents.shape[1]/2, -1, 1)[:, None]
+        
+        # Remove the baseline from the data
+        rawCurrents = None if rawCurrents is None else np.asarray(rawCurrents, dtype=float)*reductiveScales
+        baselines, self.allBaselineIndCuts = self.linearBaselineFit.findBaselines(potential, currents*reductiveScales, rawCurrents)
+        baselines = baselines*reductiveScales
+        baselineCurrents = currents - baselines
+        # Find the Peak Current After Baseline Subtraction
+        allPeakIndices = [self.linearBaselineFit.findPeakGeneral(potential, baselineCurrent) for baselineCurrent in baselineCurrents*reductiveScales]
+        
+        # Report the throughput.
+        analysisTime = time.time() - startTime
+        print(f"\tFound the baselines of {len(currents)} curves in {analysisTime:.2f} s ({len(currents)/max(analysisTime, 1E-9):.1f} curves/second)")
+        
+        return baselines, baselineCurrents, allPeakIndices
+    
+    def characterizePeaks(self, potential, currents, baselineCurrents, allPeakIndices, allIndCuts = None):
+        """
+        Characterize the peaks of a stack of curves sharing one potential, all at once.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            potential: The potential shared by all the curves. Dim: numScanPoints
+            currents: The (filtered) current of each curve, used to check if it is oxidative or reductive. Dim: numCurves, numScanPoints
+            baselineCurrents: The baseline subtracted current of each curve. Dim: numCurves, numScanPoints
+            allPeakIndices: The peak indices of each curve. Dim: numCurves, numPeaks
+            allIndCuts: The baseline segment boundaries (finalIndCuts) of each curve. If None, or if a peak 
+                is not under a baseline segment, the peak is bounded by the bases of its prominence. Either 
+                way, a peak is never bounded past the lowest point between it and its neighbouring peaks.
+        Output Variable Definitions:
+            allPeakCharacteristics: A structured array (dtype self.peakInfoType) of each curve. Dim: numCurves, numPeaks
+                index: The index of the peak.
+                potential: The potential of the peak.
+                height: The baseline subtracted current of the peak (the peak current).
+                prominence: How far the peak rises above its highest base.
+                fwhm: The width (in potential) of the peak at half its prominence.
+                area: The trapezoid area of the baseline subtracted current between the peak bounds (charge).
+                    Neighbouring peaks are split at the lowest point between them.
+        --------------------------------------------------------------------------
+        The curves are placed end to end with an infinite current between them, which stops the prominence 
+        and width searches at the end of each curve. All the peaks are then characterized in one pass.
+        """
+        potential = np.asarray(potential, dtype=float)
+        currents = np.asarray(currents, dtype=float); baselineCurrents = np.asarray(baselineCurrents, dtype=float)
+        numCurves, numPoints = baselineCurrents.shape
+        # Check if each curve is oxidative or reductive.
+        reductiveScales = np.where((currents < 0).sum(axis=1) > currents.shape[1]/2, -1, 1)[:, None]
+        
+        # Find which curve each peak belongs to.
+        numPeaks = np.array([len(peakIndices) for peakIndices in allPeakIndices], dtype=int)
+        curveInds = np.repeat(np.arange(numCurves), numPeaks)
+        peakInds = np.concatenate([np.asarray(peakIndices, dtype=int).ravel() for peakIndices in allPeakIndices] + [np.empty(0, dtype=int)])
+        peakCharacteristics = np.zeros(len(peakInds), dtype=self.peakInfoType)
+        if len(peakInds) == 0:
+            return np.split(peakCharacteristics, np.cumsum(numPeaks)[:-1])
+        
+        # ---------------- Find the Prominence and the FWHM ---------------- #
+        # Place the (upward) curves end to end, separated by an infinite current.
+        curveStack = np.full((numCurves, numPoints + 1), np.inf)
+        curveStack[:, :numPoints] = baselineCurrents*reductiveScales
+        flatPeakInds = curveInds*(numPoints + 1) + peakInds
+        # Characterize every peak at once.
+        with warnings.catch_warnings():
+            # Peaks with no prominence (not a local maximum) are kept with a prominence of 0 (PeakPropertyWarning).
+            warnings.simplefilter("ignore", RuntimeWarning)
+            prominences, leftBases, rightBases = scipy.signal.peak_prominences(curveStack.ravel(), flatPeakInds)
+            _, _, leftHalfInds, rightHalfInds = scipy.signal.peak_widths(curveStack.ravel(), flatPeakInds, rel_height=0.5, prominence_data=(prominences, leftBases, rightBases))
+        # Convert the widths into potential.
+        curveOffsets = curveInds*(numPoints + 1)
+        scanPoints = np.arange(numPoints)
+        fwhm = np.abs(np.interp(rightHalfInds - curveOffsets, scanPoints, potential) - np.interp(leftHalfInds - curveOffsets, scanPoints, potential))
+        # ------------------------------------------------------------------ #
+        
+        # ---------------------- Find the Peak Bounds ---------------------- #
+        # Start with the bases of the prominence.
+        leftBounds = leftBases - curveOffsets; rightBounds = rightBases - curveOffsets
+        # Use the baseline segment under each peak.
+        if allIndCuts is not None:
+            peakPointer = 0
+            for curveInd in range(numCurves):
+                curvePeakInds = peakInds[peakPointer:peakPointer + numPeaks[curveInd]]
+                # The baseline is drawn under the peaks from finalIndCuts[1::2] to finalIndCuts[2::2].
+                segmentCuts = np.asarray(allIndCuts[curveInd][1:-1], dtype=int).reshape(-1, 2)
+                if len(segmentCuts) != 0 and len(curvePeakInds) != 0:
+                    segmentInds = np.clip(np.searchsorted(segmentCuts[:, 0], curvePeakInds, side='right') - 1, 0, None)
+                    underSegment = (segmentCuts[segmentInds, 0] <= curvePeakInds) & (curvePeakInds <= segmentCuts[segmentInds, 1])
+                    leftBounds[peakPointer:peakPointer + numPeaks[curveInd]][underSegment] = segmentCuts[segmentInds[underSegment], 0]
+                    rightBounds[peakPointer:peakPointer + numPeaks[curveInd]][underSegment] = np.minimum(segmentCuts[segmentInds[underSegment], 1], numPoints - 1)
+                peakPointer += numPeaks[curveInd]
+        
+        # Split neighbouring peaks at the lowest point between them (so a peak never absorbs its neighbour).
+        peakOrder = np.argsort(flatPeakInds, kind="stable")
+        sortedPeakInds = flatPeakInds[peakOrder]
+        hasNeighbour = curveInds[peakOrder][1:] == curveInds[peakOrder][:-1]
+        pairStarts = sortedPeakInds[:-1][hasNeighbour]; pairEnds = sortedPeakInds[1:][hasNeighbour]
+        if len(pairStarts) != 0:
+            # Gather the points between each pair of neighbouring peaks.
+            pairLengths = pairEnds - pairStarts + 1; firstPairPoints = np.cumsum(pairLengths) - pairLengths
+            pairIds = np.repeat(np.arange(len(pairStarts)), pairLengths)
+            pairPoints = pairStarts[pairIds] + np.arange(pairLengths.sum()) - firstPairPoints[pairIds]
+            # Sort the points of each pair from lowest to highest: the first is the valley.
+            lowestFirst = np.lexsort((curveStack.ravel()[pairPoints], pairIds))
+            valleyInds = pairPoints[lowestFirst[firstPairPoints]] - curveOffsets[peakOrder][:-1][hasNeighbour]
+            # Bound the left peak on its right and the right peak on its left.
+            leftPeaks = peakOrder[:-1][hasNeighbour]; rightPeaks = peakOrder[1:][hasNeighbour]
+            rightBounds[leftPeaks] = np.minimum(rightBounds[leftPeaks], valleyInds)
+            leftBounds[rightPeaks] = np.maximum(leftBounds[rightPeaks], valleyInds)
+        # ------------------------------------------------------------------ #
+        
+        # ----------------------- Find the Peak Area ----------------------- #
+        # The running trapezoid area of each curve (the potential may be decreasing).
+        trapezoidAreas = 0.5*(baselineCurrents[:, 1:] + baselineCurrents[:, :-1])*np.abs(np.diff(potential))
+        runningAreas = np.zeros((numCurves, numPoints))
+        np.cumsum(trapezoidAreas, axis=1, out=runningAreas[:, 1:])
+        # ------------------------------------------------------------------ #
+        
+        # Organize the peak characteristics.
+        peakCharacteristics["index"] = peakInds
+        peakCharacteristics["potential"] = potential[peakInds]
+        peakCharacteristics["height"] = baselineCurrents[curveInds, peakInds]
+        peakCharacteristics["prominence"] = prominences
+        peakCharacteristics["fwhm"] = fwhm
+        peakCharacteristics["area"] = runningAreas[curveInds, rightBounds] - runningAreas[curveInds, leftBounds]
         
+        # Split the peaks into their curves.
+        return np.split(peakCharacteristics, np.cumsum(numPeaks)[:-1])
@@ -138,7 +138,8 @@ class plots:
             self.saveplot(fig, fileName + " DPV Analysis", axes[1], legendAxes, legendLabels)
                 
         # Add these plots to the full plot curve.
-        self.plotFullResults(potential, current, baselineCurrent, baselineSubtractedCurrent, peakIndices, peakCurrents, peakPotentials, axFull, fileNum, fileName)
+        if axFull is not None:
+            self.plotFullResults(potential, current, baselineCurrent, baselineSubtractedCurrent, peakIndices, peakCurrents, peakPotentials, axFull, fileNum, fileName)
     
     def plotFullResults(self, potential, current, baselineCurrent, baselineSubtractedCurrent, peakIndices, peakCurrents, peakPotentials, ax, fileNum, fileName):
         # Keep Running Subplots Order
@@ -5,6 +5,11 @@
 # Basic Modules
 import os
 import sys
+import time
+import ast
+import hashlib
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from natsort import natsorted
@@ -27,12 +32,30 @@ class handlingExcelFormat:
         self.filteredData_Sheetname = "Filtered Data; File 0"
         self.baselineCurrent_Sheetname = "Baseline Current; File 0"
         self.baselineSubtractedCurrent_Sheetname = "Final Current; File 0"
+        self.baselineInfo_SheetName = "Baseline Info; File 0"
         
         self.excelFolder = "Excel Files/"
         
         # Excel parameters
         self.maxAddToexcelSheet = 1048500  # Max Rows in a Worksheet
-        
+
+        # CHI binary (.bin) layout: little-endian fields at fixed byte offsets.
+        self.chiBinaryMagic = b"\x80\xf2\x1d\x00"
+        self.chiBinaryHeaderSize = 1691     # The samples start after the header.
+        self.chiBinaryNumPointsOffset = 615
+        self.chiBinaryDateOffset = 627      # Year, month, day, hour, minute, second.
+        self.chiBinaryModelOffset = 659
+        self.chiBinaryCurrentsPerPoint = {"SWV": 3}  # Difference, forward, reverse currents.
+        self.chiBinaryParameterOffsets = {
+            "Init E (V)": 1091, "Final E (V)": 1095, "Incr E (V)": 1111,
+            "Sensitivity (A/V)": 1131, "Quiet Time (sec)": 1135,
+            "Amplitude (V)": 1155, "Frequency (Hz)": 1159,
+        }
+
+        # Jihong's board log: the program parameters and the potential window of each (range_n, range_p).
+        self.jihongBoardParameters = {"type:": "Program Type", "scan rate:": "Scan Rate", "range_n:": "Range N", "range_p:": "Range P", "tia gain:": "TIA Gain"}
+        self.jihongBoardPotentialWindows = {(0, 0): (-0.004, -0.5)}  # (First, last) potential in volts. Scans with other codes are skipped: add their window here.
+
     def convertToXLSX(self, inputExcelFile):
         """
         Converts .xls Files to .xlsx Files That OpenPyxl Can Read
@@ -136,14 +159,150 @@ class handlingExcelFormat:
         return worksheet
     
 
+class parsedDataCache:
+    """
+    On-disk cache of the parsed data and scan parameters: one .npz per input file in the 'Cache Files/' folder.
+    An entry is only used if the file's path, size, and parse settings match and either its
+    modification time or its content hash matches. evictData removes the oldest entries once
+    the folder grows past maxCacheSize (bytes). Curves of different lengths (ragged) are stored
+    end to end with their lengths, like the peaks. If the parse returned the SWV forward/reverse
+    currents (returnAllCurrents), they are stored too (the parse settings tell the entries apart).
+    """
+    
+    def __init__(self, maxCacheSize = 500*1024**2):
+        self.cacheFolder = "Cache Files/"
+        self.maxCacheSize = maxCacheSize
+        
+    def getCacheFile(self, inputFile, outputFolder):
+        return outputFolder + self.cacheFolder + os.path.basename(inputFile) + ".npz"
+    
+    def hashFile(self, inputFile):
+        fileHash = hashlib.sha1()
+        with open(inputFile, "rb") as inputData:
+            for fileChunk in iter(lambda: inputData.read(1024*1024), b""):
+                fileHash.update(fileChunk)
+        return fileHash.hexdigest()
+    
+    def loadData(self, inputFile, outputFolder, parseSettings = ""):
+        cacheFile = self.getCacheFile(inputFile, outputFolder)
+        # If the file was never cached.
+        if not os.path.isfile(cacheFile):
+            return None
+        
+        fileStats = os.stat(inputFile)
+        try:
+            with np.load(cacheFile, allow_pickle=False) as cachedData:
+                cachedData = {dataName: cachedData[dataName] for dataName in cachedData.files}
+        # If the entry is unreadable, parse the file again.
+        except Exception:
+            return None
+        
+        # The file must be the same file, parsed the same way.
+        if str(cachedData["filePath"]) != os.path.abspath(inputFile) or str(cachedData["parseSettings"]) != parseSettings \
+                or int(cachedData["fileSize"]) != fileStats.st_size:
+            return None
+        # If the file was touched, check that the contents did not change.
+        if int(cachedData["fileTime"]) != fileStats.st_mtime_ns:
+            if str(cachedData["fileHash"]) != self.hashFile(inputFile):
+                return None
+            # Store the new time so the file is not hashed again.
+            cachedData["fileTime"] = fileStats.st_mtime_ns
+            np.savez(cacheFile, **cachedData)
+        
+        # Unpack the data.
+        try:
+            scanParameters = ast.literal_eval(str(cachedData["scanParameters"]))
+        # Entries from before the scan parameters were cached (or values repr cannot round trip).
+        except (KeyError, ValueError, SyntaxError):
+            return None
+        potential = cachedData["potential"]
+        current = cachedData["current"]
+        if len(cachedData.get("curveLengths", [])) != 0:
+            curveSplits = np.cumsum(cachedData["curveLengths"])[:-1]
+            potential = list(np.split(potential, curveSplits)); current = list(np.split(current, curveSplits))
+        peakSplits = np.cumsum(cachedData["numPeaks"])[:-1]
+        peakPotentialList = [list(peakPotentials) for peakPotentials in np.split(cachedData["peakPotentials"], peakSplits)]
+        peakCurrentList = [list(peakCurrents) for peakCurrents in np.split(cachedData["peakCurrents"], peakSplits)]
+        
+        fileData = (potential, current, peakPotentialList, peakCurrentList, scanParameters)
+        # Add the SWV forward/reverse currents if they were parsed.
+        if "hasSwvCurrents" in cachedData:
+            swvCurrents = {"Forward": cachedData["forwardCurrent"], "Reverse": cachedData["reverseCurrent"]} if bool(cachedData["hasSwvCurrents"]) else None
+            fileData = (*fileData, swvCurrents)
+        
+        # Mark the entry as recently used.
+        os.utime(cacheFile)
+        return fileData
+    
+    def saveData(self, inputFile, outputFolder, fileData, parseSettings = ""):
+        potential, current, peakPotentialList, peakCurrentList, scanParameters = fileData[0:5]
+        cacheFile = self.getCacheFile(inputFile, outputFolder)
+        os.makedirs(os.path.dirname(cacheFile), exist_ok = True)
+        
+        # Place ragged curves (for example, a log that ended mid-scan) end to end.
+        curveLengths = np.empty(0, dtype=int)
+        if isinstance(potential, list) and len(set(len(curvePotential) for curvePotential in potential)) > 1:
+            curveLengths = np.array([len(curvePotential) for curvePotential in potential], dtype=int)
+            potential = np.concatenate(potential); current = np.concatenate(current)
+        # Store the SWV forward/reverse currents if they were parsed (None for DPV).
+        swvData = {}
+        if len(fileData) == 6:
+            swvCurrents = fileData[5]
+            swvData = {"hasSwvCurrents": swvCurrents is not None,
+                       "forwardCurrent": np.asarray(swvCurrents["Forward"]) if swvCurrents is not None else np.empty(0),
+                       "reverseCurrent": np.asarray(swvCurrents["Reverse"]) if swvCurrents is not None else np.empty(0)}
+        
+        # Save the data with the information identifying the file.
+        fileStats = os.stat(inputFile)
+        np.savez(cacheFile, potential = np.asarray(potential), current = np.asarray(current), curveLengths = curveLengths,
+                 numPeaks = np.array([len(peakPotentials) for peakPotentials in peakPotentialList], dtype=int),
+                 peakPotentials = np.array([peak for peakPotentials in peakPotentialList for peak in peakPotentials], dtype=float),
+                 peakCurrents = np.array([peak for peakCurrents in peakCurrentList for peak in peakCurrents], dtype=float),
+                 filePath = os.path.abspath(inputFile), fileSize = fileStats.st_size, fileTime = fileStats.st_mtime_ns,
+                 fileHash = self.hashFile(inputFile), parseSettings = parseSettings, scanParameters = repr(scanParameters), **swvData)
+        
+    def removeData(self, inputFile, outputFolder):
+        cacheFile = self.getCacheFile(inputFile, outputFolder)
+        if os.path.isfile(cacheFile):
+            os.remove(cacheFile)
+        
+    def evictData(self, outputFolder):
+        cacheFolder = outputFolder + self.cacheFolder
+        if not os.path.isdir(cacheFolder):
+            return
+        cacheFiles = [cacheFolder + cacheFile for cacheFile in os.listdir(cacheFolder) if cacheFile.endswith(".npz")]
+        # Remove the least recently used entries first.
+        cacheFiles.sort(key = lambda cacheFile: os.stat(cacheFile).st_mtime)
+        cacheSize = sum(os.path.getsize(cacheFile) for cacheFile in cacheFiles)
+        while cacheSize > self.maxCacheSize and len(cacheFiles) != 0:
+            cacheFile = cacheFiles.pop(0)
+            cacheSize -= os.path.getsize(cacheFile)
+            os.remove(cacheFile)
+    
+    def clearData(self, outputFolder):
+        cacheFolder = outputFolder + self.cacheFolder
+        if os.path.isdir(cacheFolder):
+            for cacheFile in os.listdir(cacheFolder):
+                if cacheFile.endswith(".npz"):
+                    os.remove(cacheFolder + cacheFile)
+
+
 class processFiles(handlingExcelFormat):
     
-    def getFiles(self, dataDirectory, removeFilesContaining, analyzeFilesContaining):
+    def __init__(self, maxCacheSize = 500*1024**2):
+        super().__init__()
+        # Initialize the cache of the parsed files.
+        self.dataCache = parsedDataCache(maxCacheSize)
+    
+    def getFiles(self, dataDirectory, removeFilesContaining, analyzeFilesContaining, readBinaryFiles = False):
         # Setup parameters
         analysisFiles = []; filesAdded = set();
+        # If the user wants them, look at CHI binary files first so they are used over their (larger) text copies.
+        # The binary currents are float32, so results differ slightly from the text copies (opt-in until the text route is retired).
+        directoryFiles = sorted(os.listdir(dataDirectory), key = lambda fileName: not fileName.endswith(".bin"))
         
         # For each file in the directory
-        for fileName in os.listdir(dataDirectory):
+        for fileName in directoryFiles:
             fileBase = os.path.splitext(fileName)[0]
             fullPath = dataDirectory + fileName
 
@@ -163,7 +322,7 @@ class processFiles(handlingExcelFormat):
                 continue
             
             # Keep track of previously unseen analysis files.
-            if fileName.endswith((".txt",'.csv','.xlsx')) or "." not in fileName:
+            if fileName.endswith((".txt",'.csv','.xlsx')) or "." not in fileName or (readBinaryFiles and fileName.endswith(".bin")):
                 analysisFiles.append(fullPath)
                 filesAdded.add(fileBase)
         
@@ -171,185 +330,441 @@ class processFiles(handlingExcelFormat):
         if len(analysisFiles) == 0:
             # Stop the program.
             print("Found the Following Files:", os.listdir(dataDirectory))
-            sys.exit("No TXT/CSV/XLSX Files Found in the Data Folder: " + dataDirectory)
+            sys.exit("No TXT/CSV/XLSX/BIN Files Found in the Data Folder: " + dataDirectory)
         
         # Sort the files and return them
         analysisFiles = natsorted(analysisFiles)
         return analysisFiles
     
+    def getFileStates(self, analysisFiles):
+        # The size and last modification time of each file that still exists.
+        fileStates = {}
+        for analysisFile in analysisFiles:
+            if os.path.exists(analysisFile):
+                fileStates[analysisFile] = (os.path.getsize(analysisFile), os.path.getmtime(analysisFile))
+        return fileStates
+    
+    def watchFiles(self, dataDirectory, removeFilesContaining, analyzeFilesContaining, analyzedFiles = [], pollInterval = 5, maxPolls = None, readBinaryFiles = False, yieldIdlePolls = False):
+        """
+        Poll the data folder and yield the files that are new or modified since they were last analyzed.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            analyzedFiles: The files that were already analyzed (as given by getFiles).
+            pollInterval: The time in seconds between each look at the folder.
+            maxPolls: The number of times to look at the folder. None watches forever.
+            readBinaryFiles: Use CHI binary files over their text copies (as in getFiles).
+            yieldIdlePolls: Also yield an empty list when a poll finds no ready files (lets the caller run timed work).
+        Yields:
+            readyFiles: A list of the new/modified files. A file is only ready once its size and
+                modification time did not change between two polls (the instrument finished writing).
+        --------------------------------------------------------------------------
+        """
+        analyzedStates = self.getFileStates(analyzedFiles)
+        pendingStates = {}
+        
+        numPolls = 0
+        while maxPolls is None or numPolls < maxPolls:
+            time.sleep(pollInterval); numPolls += 1
+            # Get the files that currently follow the user's rules.
+            if not os.path.isdir(dataDirectory): continue
+            try:
+                currentStates = self.getFileStates(self.getFiles(dataDirectory, removeFilesContaining, analyzeFilesContaining, readBinaryFiles))
+            except SystemExit:
+                continue
+            
+            readyFiles = []
+            for analysisFile, fileState in currentStates.items():
+                # Skip the files we already analyzed.
+                if analyzedStates.get(analysisFile) == fileState:
+                    continue
+                # If the file stopped changing, it is ready.
+                if pendingStates.get(analysisFile) == fileState:
+                    readyFiles.append(analysisFile)
+                    analyzedStates[analysisFile] = fileState
+            # Remember the files still being written.
+            pendingStates = {analysisFile: fileState for analysisFile, fileState in currentStates.items() if analyzedStates.get(analysisFile) != fileState}
+            
+            if len(readyFiles) != 0 or yieldIdlePolls:
+                yield readyFiles
+    
     class cellObject:
         def __init__(self, value):
             self.value = value
 
-    def extractCHIData_DPV(self, chiWorksheet):
-        peakCurrentList = []; peakPotentialList = []; 
-        potential = []; current = []; searchForPeakInfo = True
+    def readCHIHeader(self, fileLines, delimiter = ","):
+        """
+        Parse the header of a CHI text export (everything before the data block).
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            fileLines: A list of the lines in the CHI text export.
+            delimiter: The delimiter separating the columns of the data block.
+        Output Variable Definitions:
+            scanParameters: A dictionary of the header information (Init E (V), Incr E (V), Frequency (Hz), ...).
+            dataStartInd: The index of the first line after the 'Potential/V' column line.
+            delimiter: The delimiter used by the data block.
+            Returns None if the file is not a CHI export (e.g. Jihong's board).
+        --------------------------------------------------------------------------
+        """
+        # Initialize the header information.
+        scanParameters = {"Technique": None, "Instrument Model": None, "Square Wave Voltammetry": False}
+
+        # For each line in the header.
+        for lineInd in range(len(fileLines)):
+            line = fileLines[lineInd].strip()
+            # If the line is empty.
+            if len(line) == 0:
+                continue # Read in the next line.
+
+            # Base case: this is Jihong's board (no CHI header).
+            if 'Command Sent' in line:
+                return None
+
+            # If we are at the data section.
+            elif "Potential/V" in line:
+                # Commas could indicate the wrong delimiter.
+                if delimiter not in line and ',' in line:
+                    delimiter = ','
+                scanParameters["Column Names"] = [columnName.strip() for columnName in line.split(delimiter)]
+                return scanParameters, lineInd + 1, delimiter
+
+            # The technique is the first line without a date.
+            elif scanParameters["Technique"] is None and lineInd != 0 and not line.startswith("File:"):
+                scanParameters["Technique"] = line
+            # Record the instrument used.
+            elif line.startswith("Instrument Model:"):
+                scanParameters["Instrument Model"] = line.split(":")[-1].strip()
+            # For SWV, the currents are split into difference/forward/reverse.
+            elif line.startswith("Difference:"):
+                scanParameters["Square Wave Voltammetry"] = True
+            # Record the scan parameters (CHI peak values end in units and are skipped).
+            elif " = " in line:
+                parameterName, parameterValue = line.split(" = ", 1)
+                try:
+                    scanParameters[parameterName.strip()] = float(parameterValue)
+                except ValueError:
+                    pass
+        
+        # If no data was found, this is not a CHI file.
+        return None
+
+    def readCHIText(self, chiFile, delimiter = ","):
+        """
+        Read a CHI text export directly into numpy, skipping the excel conversion.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            chiFile: The path to the CHI text export (txt or csv).
+            delimiter: The delimiter separating the columns of the data block.
+        Output Variable Definitions:
+            scanParameters: A dictionary of the header information (Init E (V), Incr E (V), Frequency (Hz), ...).
+            dataBlock: A 2D numpy array of the data block. Dim: numScanPoints, numColumns (potential first).
+            Returns None if the file is not a CHI export (e.g. Jihong's board).
+        --------------------------------------------------------------------------
+        """
+        with open(chiFile, "r") as inputData:
+            fileLines = inputData.read().splitlines()
         
+        # Find the header information.
+        chiHeader = self.readCHIHeader(fileLines, delimiter)
+        if chiHeader is None:
+            return None
+        scanParameters, dataStartInd, delimiter = chiHeader
+
+        # Remove empty rows/columns (edge effect if someone edits the file in excel).
+        dataLines = [line.rstrip().rstrip(delimiter) for line in fileLines[dataStartInd:]]
+        dataLines = [line for line in dataLines if len(line.strip()) != 0]
+        # Bulk load the numeric block.
+        dataBlock = np.loadtxt(dataLines, delimiter = delimiter, ndmin = 2)
+
+        return scanParameters, dataBlock
+    
+    def getScanParameters(self, analysisFile, delimiter = ","):
+        # CHI binary files store the parameters in the header.
+        if analysisFile.endswith(".bin"):
+            chiData = self.readCHIBinary(analysisFile)
+            if chiData is not None:
+                return chiData[0]
+            analysisFile = os.path.splitext(analysisFile)[0] + ".txt"
+        # Excel files have no scan information.
+        if analysisFile.endswith((".xlsx", ".xls")) or not os.path.isfile(analysisFile):
+            return {}
+        
+        # Read the header of the CHI text export.
+        with open(analysisFile, "r") as inputData:
+            fileLines = inputData.read().splitlines()
+        chiHeader = self.readCHIHeader(fileLines, delimiter)
+        if chiHeader is None:
+            return {}
+        
+        return chiHeader[0]
+
+    def splitCHIDataBlock(self, dataBlock, squareWaveVoltammetry, returnAllCurrents = False):
+        """
+        Split a CHI data block (Dim: numScanPoints, numColumns; potential first) into the potential and current.
+        For SWV, the columns repeat (difference, forward, reverse) for each channel and are sliced by stride.
+        If returnAllCurrents, the forward/reverse currents are also returned: {"Forward": ..., "Reverse": ...}.
+        """
+        if squareWaveVoltammetry:
+            # Keep the difference current of each channel. Dim: numChannels, numScanPoints
+            current = dataBlock[:, 1::3].T
+            potential = np.tile(dataBlock[:, 0], (len(current), 1))
+            swvCurrents = {"Forward": dataBlock[:, 2::3].T, "Reverse": dataBlock[:, 3::3].T}
+        else:
+            assert dataBlock.shape[1] == 2, "Unsure if this is required"
+            potential = dataBlock[:, 0]
+            current = dataBlock[:, 1]
+            swvCurrents = None
+
+        # CHI peak information is not used.
+        peakCurrentList = [[] for _ in range(len(current))]
+        peakPotentialList = [[] for _ in range(len(current))]
+
+        if returnAllCurrents:
+            return potential, current, peakPotentialList, peakCurrentList, swvCurrents
+        return potential, current, peakPotentialList, peakCurrentList
+
+    def extractCHIData_Text(self, chiFile, delimiter = ",", returnAllCurrents = False):
+        # Read in the CHI file.
+        chiData = self.readCHIText(chiFile, delimiter)
+        if chiData is None:
+            return None
+        scanParameters, dataBlock = chiData
+
+        return self.splitCHIDataBlock(dataBlock, scanParameters["Square Wave Voltammetry"], returnAllCurrents)
+
+    def extractCHIData_DPV(self, chiWorksheet, returnAllCurrents = False):
         # Initialize flags for the type of program.
         squareWaveVoltammetry = False
-        differenceChannel = False
         
-        excelsheetRows = list(chiWorksheet.rows)
+        excelsheetRows = list(chiWorksheet.iter_rows(values_only = True))
         
-        # For each row in the excel sheet.
+        # For each row in the header of the excel sheet.
         for rowInd in range(len(excelsheetRows)):
             row = excelsheetRows[rowInd]
-            firstCellValue = row[0].value
+            firstCellValue = row[0] if len(row) != 0 else None
             # If the cell is empty.
             if firstCellValue == None:
                 continue # Read in the next value.
+            firstCellValue = str(firstCellValue)
             
             # Base case: this is Jihong's board
             if 'Command Sent' in firstCellValue:
                 return self.extractJihongBoardData(chiWorksheet)
             
             # Commas could indicate the wrong delimiter.
-            elif ',' in firstCellValue:
-                cellValues = firstCellValue.split(",")
-                # Reinitialize the row/cellValue
-                row = [self.cellObject(cellValue) for cellValue in cellValues]
-                firstCellValue = row[0].value
+            wrongDelimiter = ',' in firstCellValue
+            if wrongDelimiter:
+                row = firstCellValue.split(",")
+                firstCellValue = row[0]
                 
             # For SWV, we are looking for the Difference tab
             if firstCellValue.startswith("Difference:"):
                 squareWaveVoltammetry = True
-                differenceChannel = True
-            elif firstCellValue.startswith(("Forward:", "Reverse:")):
-                assert squareWaveVoltammetry
-                differenceChannel = False
-            
-            # If we havent found the data yet.
-            if searchForPeakInfo:
-                # If we are at the data section.
-                if "Potential/V" in firstCellValue:
-                    searchForPeakInfo = False
-                    # Find the number of columns of data.
-                    for numCurrentChannels in range(1, len(row)):
-                        if row[numCurrentChannels].value == None:
-                            break
-                    if not squareWaveVoltammetry:
-                        assert numCurrentChannels == 1, "Unsure if this is required"
-                    else:
-                        for channelInd in range(1, numCurrentChannels + 1, 3):
-                            potential.append([])
-                            current.append([])
-                    
-                if squareWaveVoltammetry and not differenceChannel:
-                    continue
-                
-                # If Peak Found by CHI, Get Peak Potential
-                if firstCellValue.startswith("Ep = "):
-                    peakPotential = float(firstCellValue.split(" = ")[-1][:-1])
-                    peakPotentialList.append(peakPotential)
-                # If Peak Found by CHI, Get Peak Current
-                elif firstCellValue.startswith("ip = "):
-                    peakCurrent = float(firstCellValue.split(" = ")[-1][:-1])
-                    peakCurrentList.append(peakCurrent)
-                    
-            else:
-                # Break out of Loop if no More Data (edge effect if someone edits excel)
-                if row[0].value == None and len(potential) != 0:
-                    break
-                
-                if squareWaveVoltammetry:
-                    signalInd = 0
-                    for channelInd in range(1, numCurrentChannels + 1, 3):
-                        potential[signalInd].append(float(row[0].value))
-                        current[signalInd].append(float(row[channelInd].value))
-                        signalInd += 1
-                else:
-                    # Find the Potential and Current Data points
-                    potential.append(float(row[0].value))
-                    current.append(float(row[1].value))
+            # If we are at the data section.
+            elif "Potential/V" in firstCellValue:
+                break
+        else:
+            sys.exit("\nNo CHI Data Found in the Excel Sheet: " + chiWorksheet.title)
+        
+        # Find the number of columns of data.
+        for numColumns in range(1, len(row) + 1):
+            if numColumns == len(row) or row[numColumns] in [None, ""]:
+                break
+        
+        # Collect the data rows (edge effect if someone edits excel: skip empty rows).
+        dataRows = excelsheetRows[rowInd+1:]
+        if wrongDelimiter:
+            dataRows = [str(dataRow[0]).split(",") for dataRow in dataRows if len(dataRow) != 0 and dataRow[0] is not None]
+        dataRows = [dataRow[0:numColumns] for dataRow in dataRows if len(dataRow) != 0 and dataRow[0] not in [None, "", "\ufeff"]]
+        # Load the whole numeric block in one call.
+        dataBlock = np.array(dataRows, dtype=float).reshape(len(dataRows), numColumns)
+
+        return self.splitCHIDataBlock(dataBlock, squareWaveVoltammetry, returnAllCurrents)
+
+    def readCHIBinary(self, chiFile):
+        """
+        Read a CHI binary (.bin) file. The sample block is a view over the file's bytes.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            chiFile: The path to the CHI binary file.
+        Output Variable Definitions:
+            scanParameters: A dictionary of the header information (Technique, Init E (V), Incr E (V), Frequency (Hz), ...).
+            dataBlock: A 3D float32 numpy view of the samples. Dim: numChannels, numScanPoints, numCurrentsPerPoint
+            Returns None if the binary layout is not recognized.
+        --------------------------------------------------------------------------
+        """
+        with open(chiFile, "rb") as inputData:
+            fileBytes = inputData.read()
+        # Check that this is a CHI binary file we know how to read.
+        if len(fileBytes) < self.chiBinaryHeaderSize or not fileBytes.startswith(self.chiBinaryMagic):
+            return None
+
+        # The technique is stored as two length-prefixed strings (short name, full name).
+        shortNameLength = int.from_bytes(fileBytes[4:8], "little")
+        techniqueCode = fileBytes[8:8+shortNameLength].decode("ascii", errors="ignore")
+        fullNameStart = 8 + shortNameLength + 4
+        fullNameLength = int.from_bytes(fileBytes[fullNameStart-4:fullNameStart], "little")
+        technique = fileBytes[fullNameStart:fullNameStart+fullNameLength].decode("ascii", errors="ignore")
+        # Only square wave voltammetry has a known sample layout: (difference, forward, reverse) per point.
+        if techniqueCode not in self.chiBinaryCurrentsPerPoint:
+            return None
+        numCurrentsPerPoint = self.chiBinaryCurrentsPerPoint[techniqueCode]
 
-        # Convert to Numpy Array
-        current = np.array(current)
-        potential = np.array(potential)
+        # Read the integer and float header fields.
+        readInt = lambda offset: int(np.frombuffer(fileBytes, dtype="<i4", count=1, offset=offset)[0])
+        readFloat = lambda offset: float("%.6g" % np.frombuffer(fileBytes, dtype="<f4", count=1, offset=offset)[0])
+        scanParameters = {"Technique": technique, "Technique Code": techniqueCode, "Square Wave Voltammetry": techniqueCode == "SWV"}
+        scanParameters["Instrument Model"] = "CHI" + str(readInt(self.chiBinaryModelOffset))
+        scanParameters["Date"] = tuple(readInt(self.chiBinaryDateOffset + 4*dateInd) for dateInd in range(6))
+        for parameterName, parameterOffset in self.chiBinaryParameterOffsets.items():
+            scanParameters[parameterName] = readFloat(parameterOffset)
+        numScanPoints = readInt(self.chiBinaryNumPointsOffset)
+
+        # The sample block fills the rest of the file: one block of points per channel.
+        numSampleBytes = len(fileBytes) - self.chiBinaryHeaderSize
+        bytesPerChannel = numScanPoints*numCurrentsPerPoint*4
+        if numScanPoints <= 0 or numSampleBytes <= 0 or numSampleBytes % bytesPerChannel != 0:
+            return None
+        numChannels = numSampleBytes // bytesPerChannel
+        dataBlock = np.frombuffer(fileBytes, dtype="<f4", offset=self.chiBinaryHeaderSize).reshape(numChannels, numScanPoints, numCurrentsPerPoint)
+
+        return scanParameters, dataBlock
+
+    def extractCHIData_Binary(self, chiFile, returnAllCurrents = False):
+        # Read in the CHI file.
+        chiData = self.readCHIBinary(chiFile)
+        if chiData is None:
+            return None
+        scanParameters, dataBlock = chiData
+
+        return self.splitCHIBinaryBlock(scanParameters, dataBlock, returnAllCurrents)
+
+    def splitCHIBinaryBlock(self, scanParameters, dataBlock, returnAllCurrents = False):
+        numChannels, numScanPoints, _ = dataBlock.shape
+
+        # The potential is not stored: rebuild it from the scan parameters (the first point is one step from Init E).
+        initialPotential = scanParameters["Init E (V)"]
+        potentialStep = scanParameters["Incr E (V)"]*np.sign(scanParameters["Final E (V)"] - initialPotential)
+        potential = np.round(initialPotential + potentialStep*np.arange(1, numScanPoints + 1), 9)
+        potential = np.tile(potential, (numChannels, 1))
+        # Keep the difference current of each channel (a view, no copy).
+        current = dataBlock[:, :, 0]
+
+        # CHI peak information is not used.
         peakCurrentList = [[] for _ in range(len(current))]
         peakPotentialList = [[] for _ in range(len(current))]
 
+        if returnAllCurrents:
+            swvCurrents = {"Forward": dataBlock[:, :, 1], "Reverse": dataBlock[:, :, 2]}
+            return potential, current, peakPotentialList, peakCurrentList, swvCurrents
         return potential, current, peakPotentialList, peakCurrentList
-    
-    def extractJihongBoardData(self, chiWorksheet):
-        # Initialize program information.
-        programTypes = []; scanRates = []; range_ns = []
-        range_ps = []; tia_gains = []
-        collectData = False
-        # Intiialize holds for current and potential.
-        allPeakCurrents = [[]]; allPeakPotentials = [[]];
-        potential = []; allCurrent = [[]]; 
-        
-        # Loop through each row.
-        rowGenerator = chiWorksheet.rows
-        for cell in rowGenerator:
-            # Get Cell Value
-            cellVal = cell[0].value
+
+    def parseJihongBoardLines(self, logLines, programTypes = None, rangePs = None):
+        """
+        Generator over the scans in Jihong's board log. Only one scan is held in memory at a time.
+        --------------------------------------------------------------------------
+        Input Variable Definitions:
+            logLines: An iterable of the lines in the log (e.g. an open file).
+            programTypes: The program types to keep. None keeps all the programs.
+            rangePs: The range_p values to keep. None keeps all the scans.
+        Yields:
+            scanInfo: A dictionary with the Program Type, Scan Rate, Range N, Range P, TIA Gain,
+                Potential (V), and Current (A; the difference of each pair of readings).
+            Scans whose (range_n, range_p) is not in self.jihongBoardPotentialWindows are skipped.
+        --------------------------------------------------------------------------
+        """
+        scanInfo = None
+        # For each line in the log.
+        for line in logLines:
+            line = str(line).strip() if line is not None else ""
             # If nothing found, ignore.
-            if cellVal == None:
+            if len(line) == 0:
                 continue
             
             # If a new program started.
-            elif 'Command Sent' in cellVal:
+            elif 'Command Sent' in line:
                 # Signal new data is coming.
-                assert collectData == False
-                collectData = True
-                if len(allCurrent[-1]) != 0:
-                    allCurrent.append([])
-                    allPeakCurrents.append([])
-                    allPeakPotentials.append([])
+                scanInfo = {parameterName: None for parameterName in self.jihongBoardParameters.values()}
+                scanValues = []
             
-            # If our program is running
-            elif collectData:
-                # Type of program found.
-                if "type:" in cellVal:
-                    programType = float(cellVal.split("type:")[-1])                    
-                    if programType != 1: collectData = False; continue
-                    programTypes.append(programType)
-                # Scan rate found.
-                elif"scan rate:" in cellVal:
-                    scanRates.append(float(cellVal.split("scan rate:")[-1]))
-                # Range N of program found.
-                elif "range_n:" in cellVal:
-                    range_ns.append(float(cellVal.split("range_n:")[-1]))
-                # Range P of program found.
-                elif "range_p:" in cellVal:
-                    range_p = float(cellVal.split("range_p:")[-1])
-                    if range_p != 0: collectData = False; continue
-                    range_ps.append(range_p)
-                # Type of program found.
-                elif "tia gain:" in cellVal:
-                    tia_gains.append(float(cellVal.split("tia gain:")[-1]))
-                    
-                # If the program stoped
-                elif "Measurement Complete:" in cellVal:
-                    collectData = False
-                
-                # Else, we have data to analyze
+            # If our program is not running (or not selected).
+            elif scanInfo is None:
+                continue
+            
+            # If the program stoped
+            elif "Measurement Complete:" in line:
+                scanInfo = self.compileJihongBoardScan(scanInfo, scanValues)
+                if scanInfo is not None:
+                    yield scanInfo
+                scanInfo = None
+            
+            # Else, we have a program parameter or data.
+            else:
+                for parameterLabel, parameterName in self.jihongBoardParameters.items():
+                    if parameterLabel in line:
+                        scanInfo[parameterName] = float(line.split(parameterLabel)[-1])
+                        break
                 else:
-                    # Subtract the two next currents.
-                    lowCurrent = float(cellVal)
-                    highCurrent = float(next(rowGenerator)[0].value) # Get the next value
-                    currentDiff = highCurrent - lowCurrent
-                    # Store the current value.
-                    allCurrent[-1].append(currentDiff)
-        if len(allCurrent[-1]) == 0: 
-            allCurrent.pop()
-            allPeakCurrents.pop()
-            allPeakPotentials.pop()
-        allCurrent = np.array(allCurrent)*10**-6
+                    scanValues.append(float(line))
+                    continue
+                
+                # Skip the programs the user did not select.
+                if (programTypes is not None and scanInfo["Program Type"] not in programTypes) or \
+                        (rangePs is not None and scanInfo["Range P"] is not None and scanInfo["Range P"] not in rangePs):
+                    scanInfo = None
+        
+        # If the log ended while a program was still running.
+        if scanInfo is not None and len(scanValues) > 1:
+            scanInfo = self.compileJihongBoardScan(scanInfo, scanValues)
+            if scanInfo is not None:
+                yield scanInfo
+    
+    def compileJihongBoardScan(self, scanInfo, scanValues):
+        # Subtract each pair of currents (uAmps -> Amps).
+        scanValues = np.asarray(scanValues[0:len(scanValues)//2*2])
+        current = (scanValues[1::2] - scanValues[0::2])*10**-6
         
-        # Get voltage information
-        minPotential, maxPotential = -0.004, -0.5
-        # Calculate the step size
-        step_size = -(minPotential - maxPotential) / (len(allCurrent[0]) - 1)
-        # Generate the interpolated values
-        potential = np.arange(minPotential, maxPotential + step_size,  step_size)
-        assert len(potential) == len(allCurrent[0])  
-        # Make more rows
-        allPotentials = np.tile(potential, (len(allCurrent), 1))
+        # Get voltage information from the logged range. Skip the scan if its window is unknown.
+        potentialWindow = (scanInfo["Range N"], scanInfo["Range P"])
+        if potentialWindow not in self.jihongBoardPotentialWindows:
+            print("\tSkipping Scan with an Unknown Potential Window for range_n/range_p:", potentialWindow)
+            return None
+        minPotential, maxPotential = self.jihongBoardPotentialWindows[potentialWindow]
+        
+        scanInfo["Potential"] = np.linspace(minPotential, maxPotential, len(current))
+        scanInfo["Current"] = current
+        return scanInfo
+    
+    def streamJihongBoardData(self, logFile, programTypes = None, rangePs = None):
+        # Stream the scans directly from the raw log.
+        with open(logFile, "r") as logData:
+            yield from self.parseJihongBoardLines(logData, programTypes, rangePs)
+    
+    def compileJihongBoardData(self, allScans):
+        # Intiialize holds for current and potential.
+        allPotentials = []; allCurrent = []
+        for scanInfo in allScans:
+            allPotentials.append(scanInfo["Potential"])
+            allCurrent.append(scanInfo["Current"])
+        # If no data found, this is not a log we can analyze.
+        if len(allCurrent) == 0:
+            return None
+        
+        # Stack the scans if they are the same length.
+        if all(len(current) == len(allCurrent[0]) for current in allCurrent):
+            allPotentials = np.array(allPotentials); allCurrent = np.array(allCurrent)
+        allPeakCurrents = [[] for _ in range(len(allCurrent))]
+        allPeakPotentials = [[] for _ in range(len(allCurrent))]
                 
         return allPotentials, allCurrent, allPeakPotentials, allPeakCurrents
     
+    def extractJihongBoardLog(self, logFile, programTypes = [1], rangePs = [0]):
+        return self.compileJihongBoardData(self.streamJihongBoardData(logFile, programTypes, rangePs))
+    
+    def extractJihongBoardData(self, chiWorksheet, programTypes = [1], rangePs = [0]):
+        # Loop through the first cell of each row.
+        logLines = (row[0] if len(row) != 0 else None for row in chiWorksheet.iter_rows(values_only = True))
+        return self.compileJihongBoardData(self.parseJihongBoardLines(logLines, programTypes, rangePs))
+    
     def extractCompiledAnalysis(self, excelSheet):
         # Intiialize holds for current and potential.
         allPeakCurrents = [[]]; allPeakPotentials = [[]];
@@ -387,12 +802,25 @@ class processFiles(handlingExcelFormat):
 
         return allPotential, allCurrent, allPeakPotentials, allPeakCurrents
     
-    def getData(self, oldFile, outputFolder, testSheetNum = 0, excelDelimiter = ","):
+    def packFileData(self, chiData, scanParameters, returnAllCurrents = False):
+        # Add the scan parameters, and the SWV forward/reverse currents if the user wants them (None if not SWV).
+        swvCurrents = chiData[4] if len(chiData) == 5 else None
+        if returnAllCurrents:
+            return (*chiData[0:4], scanParameters, swvCurrents)
+        return (*chiData[0:4], scanParameters)
+    
+    def getData(self, oldFile, outputFolder, testSheetNum = 0, excelDelimiter = ",", saveXL = False, returnAllCurrents = False):
         """
         --------------------------------------------------------------------------
         Input Variable Definitions:
             oldFile: The Path to the Excel File Containing the Data: txt, csv, xls, xlsx
             testSheetNum: An Integer Representing the Excel Worksheet (0-indexed) Order.
+            saveXL: Also save an XLSX copy of TXT/CSV files in the Excel Files folder.
+            returnAllCurrents: Also return the SWV forward/reverse currents.
+        Output Variable Definitions:
+            potential, current, peakPotentialList, peakCurrentList: The data in the file.
+            scanParameters: The information about the scan (the CHI header). Empty if the file has none.
+            swvCurrents: Only if returnAllCurrents. {"Forward": ..., "Reverse": ...} (Dim: numChannels, numScanPoints), None if not SWV.
         --------------------------------------------------------------------------
         """ 
         # Ignore temporary files
@@ -402,6 +830,39 @@ class processFiles(handlingExcelFormat):
             sys.exit("\nThe following Input File Does Not Exist: " + oldFile)
        
         isDocument = "." not in oldFile.split("/")[-1] # Documents have no extension.        
+        # Read CHI Binary Files Directly
+        if oldFile.endswith(".bin"):
+            chiData = self.readCHIBinary(oldFile)
+            if chiData is not None:
+                print("\nExtracting Data from the CHI Binary File:", oldFile)
+                scanParameters, dataBlock = chiData
+                return self.packFileData(self.splitCHIBinaryBlock(scanParameters, dataBlock, returnAllCurrents), scanParameters, returnAllCurrents)
+            # If the binary layout is unknown, use the text copy of the data.
+            textFile = os.path.splitext(oldFile)[0] + ".txt"
+            if not os.path.exists(textFile):
+                sys.exit("\nUnknown CHI Binary Format and No TXT Copy Found: " + oldFile)
+            return self.getData(textFile, outputFolder, testSheetNum, excelDelimiter, saveXL, returnAllCurrents)
+        
+        # Read CHI TXT and CSV Files Directly
+        if (oldFile.endswith((".txt", ".csv")) or isDocument) and excelDelimiter != "fixedWidth":
+            chiData = self.readCHIText(oldFile, excelDelimiter); scanParameters = {}
+            if chiData is not None:
+                scanParameters, dataBlock = chiData
+                chiData = self.splitCHIDataBlock(dataBlock, scanParameters["Square Wave Voltammetry"], returnAllCurrents)
+            else:
+                # Else, this could be Jihong's board.
+                chiData = self.extractJihongBoardLog(oldFile)
+            # If the file was a CHI export, we are done.
+            if chiData is not None:
+                print("\nExtracting Data from the CHI File:", oldFile)
+                # Save an excel copy if the user wants one.
+                if saveXL:
+                    os.makedirs(outputFolder + self.excelFolder, exist_ok = True)
+                    excelFile = outputFolder + self.excelFolder + os.path.splitext(os.path.basename(oldFile))[0] + ".xlsx"
+                    xlWorkbook, _ = self.convertToExcel(oldFile, excelFile, excelDelimiter = excelDelimiter, overwriteXL = True, testSheetNum = testSheetNum)
+                    xlWorkbook.close()
+                return self.packFileData(chiData, scanParameters, returnAllCurrents)
+        
         # Convert TXT and CSV Files to XLSX
         if oldFile.endswith((".txt", ".csv")) or isDocument:
             # Extract Filename Information
@@ -421,31 +882,76 @@ class processFiles(handlingExcelFormat):
             xlWorkbook = xl.load_workbook(excelFile, data_only=True, read_only=True)
             xlWorksheet = xlWorkbook.worksheets[testSheetNum:]
         else:
-            sys.exit("\nThe Following File is Neither CSV, TXT, Nor XLSX: " + oldFile)
+            sys.exit("\nThe Following File is Neither CSV, TXT, BIN, Nor XLSX: " + oldFile)
         
         # Extract the Data
         print("\nExtracting Data from the Excel File:", excelFile)
         if xlWorksheet[0].title == self.signalData_Sheetname:
-            potential, current, peakPotentialList, peakCurrentList = self.extractCompiledAnalysis(xlWorksheet[0])
+            chiData = self.extractCompiledAnalysis(xlWorksheet[0])
         else:
-            potential, current, peakPotentialList, peakCurrentList = self.extractCHIData_DPV(xlWorksheet[0])
+            chiData = self.extractCHIData_DPV(xlWorksheet[0], returnAllCurrents)
                     
         xlWorkbook.close()
-        # Finished Data Collection: Close Workbook and Return Data to User
-        return potential, current, peakPotentialList, peakCurrentList
+        # Finished Data Collection: Close Workbook and Return Data to User (excel files have no scan information)
+        return self.packFileData(chiData, {}, returnAllCurrents)
+    
+    def loadFileData(self, analysisFile, outputFolder, testSheetNum = 0, excelDelimiter = ",", saveXL = False, useCache = True, parseSettings = "", returnAllCurrents = False):
+        # Use the cached data if the file did not change (the excel copy must be made from the file itself).
+        if useCache and not saveXL:
+            fileData = self.dataCache.loadData(analysisFile, outputFolder, parseSettings)
+            if fileData is not None:
+                print("\nExtracting Data from the Cache:", analysisFile)
+                return fileData
+        
+        # Extract the new data.
+        fileData = self.getData(analysisFile, outputFolder, testSheetNum, excelDelimiter, saveXL, returnAllCurrents)
+        # Cache the data. The file was parsed either way: a cache failure only costs the next run.
+        if useCache:
+            try:
+                self.dataCache.saveData(analysisFile, outputFolder, fileData, parseSettings)
+            except Exception as cacheError:
+                print(f"\tCould Not Cache {analysisFile}: {cacheError}")
+                self.dataCache.removeData(analysisFile, outputFolder)
+        
+        return fileData
     
-    def getAllData(self, allFiles, outputFolder, testSheetNum = 0, excelDelimiter = ","):
+    def getAllData(self, allFiles, outputFolder, testSheetNum = 0, excelDelimiter = ",", saveXL = False, useCache = True, rebuildCache = False, numWorkers = 1, returnAllCurrents = False):
         # Initialize holders for file data.
         allPeakPotentials = []; allPeakCurrents = []
         allPotential = []; allCurrent = []
-        fileNames = []
+        fileNames = []; self.failedFiles = []
+        # Per-curve information (file name, channel, technique, scan parameters; the SWV "Forward Current"/"Reverse Current" if returnAllCurrents).
+        self.curveInfo = []
+        
+        # Start from an empty cache if the user wants to rebuild it.
+        if rebuildCache:
+            self.dataCache.clearData(outputFolder)
+        fileArgs = (outputFolder, testSheetNum, excelDelimiter, saveXL, useCache, f"{testSheetNum}; {excelDelimiter}; {returnAllCurrents}", returnAllCurrents)
+        
+        # Read the files in parallel: the results are still collected in the sorted file order.
+        if numWorkers > 1:
+            fileExecutor = ProcessPoolExecutor(max_workers = numWorkers)
+            fileTasks = [fileExecutor.submit(self.loadFileData, analysisFile, *fileArgs).result for analysisFile in allFiles]
+        else:
+            fileTasks = [functools.partial(self.loadFileData, analysisFile, *fileArgs) for analysisFile in allFiles]
         
         # For each file.
-        for analysisFile in allFiles:
+        for analysisFile, fileTask in zip(allFiles, fileTasks):
             fileName = os.path.splitext(os.path.basename(analysisFile))[0]
             
-            # Extract the new data.
-            potential, current, peakPotentialList, peakCurrentList = self.getData(analysisFile, outputFolder, testSheetNum, excelDelimiter)
+            # Extract the new data. Report bad files without stopping the others.
+            try:
+                fileData = fileTask()
+            except (Exception, SystemExit) as parseError:
+                print(f"\nCould Not Extract Data from {analysisFile}: {parseError}")
+                self.failedFiles.append(analysisFile)
+                continue
+            potential, current, peakPotentialList, peakCurrentList, scanParameters = fileData[0:5]
+            # Keep the SWV forward/reverse currents of each channel if the user wants them.
+            swvCurrents = {}
+            if returnAllCurrents:
+                swvCurrents = {"Forward Current": None, "Reverse Current": None} if fileData[5] is None else \
+                                {"Forward Current": fileData[5]["Forward"], "Reverse Current": fileData[5]["Reverse"]}
             # Add the new incoming data.
             if isinstance(potential[0], (list, np.ndarray)):
                 allCurrent.extend(current)
@@ -453,17 +959,88 @@ class processFiles(handlingExcelFormat):
                 allPeakCurrents.extend(peakCurrentList)
                 allPeakPotentials.extend(peakPotentialList)
                 fileNames.extend([fileName + f"_{trialInd}" for trialInd in range(len(potential))])
+                self.curveInfo.extend([{"File Name": fileName + f"_{trialInd}", "File": analysisFile, "Channel": trialInd, **scanParameters,
+                                        **{currentName: None if swvCurrent is None else swvCurrent[trialInd] for currentName, swvCurrent in swvCurrents.items()}} for trialInd in range(len(potential))])
             else:
                 fileNames.append(fileName)
                 allCurrent.append(current)
                 allPotential.append(potential)
                 allPeakCurrents.append(peakCurrentList)
                 allPeakPotentials.append(peakPotentialList)
-            
+                self.curveInfo.append({"File Name": fileName, "File": analysisFile, "Channel": 0, **scanParameters, **swvCurrents})
+        
+        if numWorkers > 1:
+            fileExecutor.shutdown()
+        # Keep the cache within its size limit.
+        if useCache:
+            self.dataCache.evictData(outputFolder)
+        
+        if len(self.failedFiles) != 0:
+            print("\nCould Not Extract Data from the Following Files:", self.failedFiles)
         print("\nFinished Compiling all the Data")
         return allPotential, allCurrent, allPeakPotentials, allPeakCurrents, fileNames
             
 
+class curveBatch:
+    """
+    A stack of curves. Curves sharing one potential axis are stored as a single 2D current
+    array (Dim: numCurves, numScanPoints) with one potential vector. Otherwise (ragged), the
+    potential and current are lists holding one array per curve.
+    """
+    
+    def __init__(self, allPotential, allCurrent, curveInfo = None):
+        # Store the information about each curve.
+        self.curveInfo = curveInfo if curveInfo is not None else [{} for _ in range(len(allCurrent))]
+        assert len(allPotential) == len(allCurrent) == len(self.curveInfo)
+        
+        # Check if all the curves share the same potential axis.
+        self.isDense = len(allPotential) != 0 and all(len(potential) == len(allPotential[0]) and np.array_equal(potential, allPotential[0]) for potential in allPotential)
+        if self.isDense:
+            self.potential = np.asarray(allPotential[0], dtype=float)
+            self.current = np.array(allCurrent, dtype=float)
+        else:
+            self.potential = [np.asarray(potential, dtype=float) for potential in allPotential]
+            self.current = [np.asarray(current, dtype=float) for current in allCurrent]
+    
+    def __len__(self):
+        return len(self.curveInfo)
+    
+    def __getitem__(self, curveInd):
+        # Return the potential and current of one curve.
+        if self.isDense:
+            return self.potential, self.current[curveInd]
+        return self.potential[curveInd], self.current[curveInd]
+    
+    def getFileNames(self):
+        return [curveInfo.get("File Name") for curveInfo in self.curveInfo]
+    
+    def scaleCurrent(self, scale):
+        # Scale all the currents at once.
+        if self.isDense:
+            self.current *= scale
+        else:
+            self.current = [current*scale for current in self.current]
+    
+    def applyPotentialBounds(self, potentialBounds):
+        # Only keep the data within the provided bounds. If no bounds provided, keep all the data.
+        minPotential = -np.inf if potentialBounds[0] is None else potentialBounds[0]
+        maxPotential = np.inf if potentialBounds[1] is None else potentialBounds[1]
+        if self.isDense:
+            boundsMask = np.logical_and(minPotential <= self.potential, self.potential <= maxPotential)
+            self.potential = self.potential[boundsMask]
+            self.current = self.current[:, boundsMask]
+        else:
+            boundsMasks = [np.logical_and(minPotential <= potential, potential <= maxPotential) for potential in self.potential]
+            self.current = [current[boundsMask] for current, boundsMask in zip(self.current, boundsMasks)]
+            self.potential = [potential[boundsMask] for potential, boundsMask in zip(self.potential, boundsMasks)]
+    
+    def stackCurves(self, allCurves):
+        # Stack per-curve results (e.g. baselines) the same way as the currents.
+        if self.isDense:
+            return np.array(allCurves, dtype=float)
+        return [np.asarray(curve, dtype=float) for curve in allCurves]
+            
+
 class saveExcelData(handlingExcelFormat):
     
     def getExcelDocument(self, excelFile, overwriteSave = False):
@@ -489,7 +1066,7 @@ class saveExcelData(handlingExcelFormat):
             worksheet = WB.create_sheet(self.emptySheetName)
         return WB, worksheet
     
-    def saveDataDPV(self, potential, current, baselineCurrent, baselineSubtractedCurrent, peakCurrents, peakPotentials, saveExcelPath):
+    def saveDataDPV(self, potential, current, baselineCurrent, baselineSubtractedCurrent, peakCurrents, peakPotentials, saveExcelPath, baselineInfo = {}, peakCharacteristics = None):
         print("\tSaving the analysis on the file")
         # ------------------------------------------------------------------ #
         # -------------------- Setup the excel document -------------------- #
@@ -544,6 +1121,9 @@ class saveExcelData(handlingExcelFormat):
         worksheet = WB.create_sheet(self.emptySheetName) # Add Sheet
         # Get the header for the peak information
         header = ["Peak Potentials (V)", "Peak Currents (uAmps)"]
+        # Add the peak characteristics (from dpvProtocols.characterizePeaks) if availible.
+        if peakCharacteristics is not None:
+            header.extend(["Peak Prominence (uAmps)", "Peak FWHM (V)", "Peak Area (uAmps*V)"])
             
         # Loop through/save all the data in batches of maxAddToexcelSheet.
         for firstIndexInFile in range(0, len(peakPotentials), self.maxAddToexcelSheet):
@@ -555,6 +1135,8 @@ class saveExcelData(handlingExcelFormat):
             for dataInd in range(firstIndexInFile, min(firstIndexInFile+self.maxAddToexcelSheet, len(peakPotentials))):
                 # Organize all the data
                 row = [peakPotentials[dataInd], peakCurrents[dataInd]]
+                if peakCharacteristics is not None:
+                    row.extend([float(peakCharacteristics[parameterName][dataInd]) for parameterName in ["prominence", "fwhm", "area"]])
                 
                 # Add the row to the worksheet
                 worksheet.append(row)
@@ -567,6 +1149,17 @@ class saveExcelData(handlingExcelFormat):
         if worksheet.title == self.emptySheetName:
             WB.remove(worksheet)
         
+        # ------------------------------------------------------------------ #
+        # -------------- Add baseline information to document -------------- # 
+        
+        # Record how the baseline was found (for example, the chosen polynomial order).
+        if len(baselineInfo) != 0:
+            worksheet = WB.create_sheet(self.baselineInfo_SheetName)
+            worksheet.append(["Parameter", "Value"])
+            for parameterName, parameterValue in baselineInfo.items():
+                worksheet.append([parameterName, parameterValue])
+            worksheet = self.addExcelAesthetics(worksheet) # Add Excel Aesthetics
+        
         # ------------------------------------------------------------------ #
         # ------------------------ Save the document ----------------------- #  
         # Save as New Excel File
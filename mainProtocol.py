@@ -12,7 +12,7 @@ Need to Install in the Python Enviroment Beforehand:
 import os
 import sys
 import math
-import scipy
+import time
 import numpy as np
 # Plotting modules
 import matplotlib.pyplot as plt
@@ -36,11 +36,20 @@ if __name__ == "__main__":
     # Specify conditions for reading in files.
     removeFilesContaining = []    # A list of strings that cannot be in any file analyzed.
     analyzeFilesContaining = []   # A list of strings that must be in any file analyzed.
+    saveXL = False                # Save an XLSX copy of each TXT/CSV file in 'Excel Files/'. The CHI files are read directly either way.
+    readBinaryFiles = False       # Read CHI binary (.bin) files instead of their TXT copies. Faster, but the currents are float32 (results differ slightly).
+    useCache = True               # Reuse the parsed data saved in 'Cache Files/' for files that did not change.
+    rebuildCache = False          # Clear the cache and parse every file again.
+    numWorkers = 1                # The number of processes reading in the files. Use 1 to read them one at a time.
+    watchFolder = False           # After the analysis, keep watching the data folder and analyze each new/modified file.
+    pollInterval = 5              # The time in seconds between each look at the data folder when watching.
+    compiledSaveInterval = 60     # The minimum time in seconds between rewrites of compiledAnalysis.xlsx when watching.
 
     # Specify the analysis protocol
     useCHIPeaks = False             # DEPRECATED (ASK SAM FOR USE). Use CHI calculated peaks. The peak information must be in the file.
     useLinearFit = True             # Fit a linear baseline to the peak and subtract off the baseline.
     useBaselineSubtraction = False  # Perform iterative polynomial subtraction to find the baseline of the peak. YOU MUST OPTIMIZE 'polynomialOrder'
+    useAsymmetricLeastSquares = False  # Fit a smooth baseline that stays under the peaks (arPLS). The fastest option for long or dense scans.
     
     # Specify information about the potential/current being read in.
     potentialBounds = [None, None]  # The [minimum, maximum] potential to consider in this analysis.
@@ -49,11 +58,15 @@ if __name__ == "__main__":
     # ---------------------------------------------------------------------- #
     
     # Assert the proper use of the program.
-    assert sum((useCHIPeaks, useLinearFit, useBaselineSubtraction)) == 1, "Only one protocol can be be executed."
+    assert sum((useCHIPeaks, useLinearFit, useBaselineSubtraction, useAsymmetricLeastSquares)) == 1, "Only one protocol can be be executed."
         
     # Parameters specific to the analysis protocol.
     if useBaselineSubtraction:
-        polynomialOrder = 3     # Order of the polynomial fit in baseline subtraction (Extremely important to modify)
+        polynomialOrder = 3     # Order of the polynomial fit in baseline subtraction (Extremely important to modify). Use "auto" to choose the best order of each curve.
+        polynomialOrders = range(1, 9)  # The orders considered when polynomialOrder is "auto".
+    if useLinearFit:
+        minPeakSNR = 0              # Curves whose tallest peak is below this many noise levels (of the unfiltered current) are flat and skipped. Use 0 to search every curve.
+        baselineTimeBudget = None   # The time (seconds) spent on the tangent lines of each curve before using the cheaper valley baselines. None for no limit.
 
     # Specify the Plotting Extent
     numSubPlotsX = 3  # The Number of Plots to Display in Each Row
@@ -64,14 +77,20 @@ if __name__ == "__main__":
     # Get file information
     extractData = excelProcessing.processFiles()
     saveAnalysisResults = excelProcessing.saveExcelData()
-    analysisFiles = extractData.getFiles(dataDirectory, removeFilesContaining, analyzeFilesContaining)
+    analysisFiles = extractData.getFiles(dataDirectory, removeFilesContaining, analyzeFilesContaining, readBinaryFiles)
     # Compile all the data from the files.
-    allPotential, allCurrent, allPeakPotentials, allPeakCurrents, fileNames = extractData.getAllData(analysisFiles, dataDirectory, testSheetNum = 0, excelDelimiter = ",")
+    allPotential, allCurrent, allPeakPotentials, allPeakCurrents, fileNames = extractData.getAllData(analysisFiles, dataDirectory, testSheetNum = 0, excelDelimiter = ",", saveXL = saveXL, useCache = useCache, rebuildCache = rebuildCache, numWorkers = numWorkers)
     # allPotential: A list of numpy arrays of each potential. Dim: numFiles*numChannels, numScanPoints
     # allPeakPotentials: A list of lists of peak potentials. Dim: numFiles*numChannels, numPeaksCHI
     # allCurrent: A list of numpy arrays of each current. Dim: numFiles*numChannels, numScanPoints
     # allPeakCurrents: A list of lists of peak currents. Dim: numFiles*numChannels, numPeaksCHI
     # fileNames: A list of all channels beings analyzed. Dim: numFiles*numChannels
+    
+    # Stack the curves: curves sharing a potential axis are stored as one 2D array.
+    curves = excelProcessing.curveBatch(allPotential, allCurrent, extractData.curveInfo)
+    # Scale and cull all the data at once. Only consider data within the provided bounds. If no bounds provided, use all the data.
+    curves.scaleCurrent(scaleCurrent)
+    curves.applyPotentialBounds(potentialBounds)
 
     # Create plot for all the curves.
     numSubPlotsX = min(len(fileNames), numSubPlotsX)
@@ -81,40 +100,50 @@ if __name__ == "__main__":
     
     # Compile analysis information
     dpvProtocols = dpvAnalysis.dpvProtocols()
+    if useBaselineSubtraction:
+        dpvProtocols.polynomialBaselineFit.polynomialOrders = polynomialOrders
+        dpvProtocols.polynomialBaselineFit.numWorkers = numWorkers
+    if useLinearFit:
+        dpvProtocols.linearBaselineFit.minPeakSNR = minPeakSNR
+        dpvProtocols.linearBaselineFit.timeBudget = baselineTimeBudget
     
     # ---------------------------------------------------------------------- #
     # ------------------------ Start the Analsysis ------------------------- #
     
-    peakInfo = []
-    analysisInfo = []
-    # For each file we are analyzing.
-    for dpvInd in range(len(allPotential)):
-        # Extract all the DPV information from the trial.
-        peakPotentials, peakCurrents = allPeakPotentials[dpvInd], allPeakCurrents[dpvInd]    
-        potential, unfilteredCurrent = allPotential[dpvInd], allCurrent[dpvInd]
-        fileName = fileNames[dpvInd]      
-          
+    def analyzeCurve(potential, unfilteredCurrent, peakPotentials, peakCurrents, fileName, axFull, dpvInd, batchResults = None):
         print(f"\nAnalyzing Data in {fileName}")
-        # ----------------------- Data Preprocessing ----------------------- #
-        # Scale and Cull the Data
-        unfilteredCurrent = unfilteredCurrent*scaleCurrent
-        # Only consider data within the provided bounds. If no bounds provided, use all the data.
-        unfilteredCurrent = unfilteredCurrent[np.logical_and((potentialBounds[0] or -np.inf) <= potential, potential <= (potentialBounds[1] or np.inf))]
-        potential = potential[np.logical_and((potentialBounds[0] or -np.inf) <= potential, potential <= (potentialBounds[1] or np.inf))]
         
         # ------------------------ Get DPV Baseline ------------------------ #
-        # Apply a Low Pass Filter
-        current = scipy.signal.savgol_filter(unfilteredCurrent, 7, 3)
-        
-        # Perform Iterative Polynomial Subtraction
-        if useBaselineSubtraction:
-            baselineCurrent, baselineSubtractedCurrent, peakIndices = dpvProtocols.useBaselineSubtraction(current, potential, polynomialOrder)
-        # Find Optimal Linear Baseline Under Peak
-        elif useLinearFit:
-            baselineCurrent, baselineSubtractedCurrent, peakIndices = dpvProtocols.useLinearFit(current, potential)
-        # At This Point, You BETTER be Getting the Peaks from the CHI File 
-        elif not useCHIPeaks:
-            sys.exit("Please Specify a DPV Peak Detection Mechanism")
+        # Use the results found for the whole stack of curves.
+        if batchResults is not None:
+            current, baselineCurrent, baselineSubtractedCurrent, peakIndices, baselineInfo, peakCharacteristics = batchResults
+        else:
+            baselineInfo = {}; peakCharacteristics = None
+            # Apply a Low Pass Filter
+            current = dpvProtocols.filteringMethods.savgolFilter.savgolFilter(unfilteredCurrent, 7, 3)
+            
+            # Perform Iterative Polynomial Subtraction
+            if useBaselineSubtraction:
+                baselineCurrent, baselineSubtractedCurrent, peakIndices = dpvProtocols.useBaselineSubtraction(current, potential, polynomialOrder)
+                # Record the chosen polynomial order.
+                if polynomialOrder == "auto":
+                    baselineInfo = {"Polynomial Order": int(dpvProtocols.polynomialBaselineFit.bestOrders[0]), "Order Score": float(dpvProtocols.polynomialBaselineFit.orderScores[0])}
+            # Find Optimal Linear Baseline Under Peak
+            elif useLinearFit:
+                baselineCurrent, baselineSubtractedCurrent, peakIndices = dpvProtocols.useLinearFit(current, potential, unfilteredCurrent)
+                # Record the peak screen and the baseline used.
+                baselineInfo = dict(dpvProtocols.linearBaselineFit.baselineInfo)
+            # Fit a Smooth Baseline Under the Peaks
+            elif useAsymmetricLeastSquares:
+                baselineCurrent, baselineSubtractedCurrent, peakIndices = dpvProtocols.useAsymmetricLeastSquares(current, potential)
+            # At This Point, You BETTER be Getting the Peaks from the CHI File 
+            elif not useCHIPeaks:
+                sys.exit("Please Specify a DPV Peak Detection Mechanism")
+            
+            # Find the height, prominence, width, and area of each peak.
+            if not useCHIPeaks:
+                indCuts = [dpvProtocols.baselineIndCuts] if useLinearFit else None
+                peakCharacteristics = dpvProtocols.characterizePeaks(potential, [current], [baselineSubtractedCurrent], [peakIndices], indCuts)[0]
         
         # Find the peak information
         if not useCHIPeaks:
@@ -124,41 +153,128 @@ if __name__ == "__main__":
         # ----------------- Save and plot DPV Analysis ----------------------#
         
         # Plot the results
-        plot.plotResults(potential, current, baselineCurrent, baselineSubtractedCurrent, peakIndices, peakCurrents, peakPotentials, ax, dpvInd, fileName)
-
-        # Store the data in case user wants.
-        analysisInfo.append([potential, unfilteredCurrent, current, baselineCurrent, baselineSubtractedCurrent])
-        peakInfo.append([peakPotentials, peakCurrents])
+        plot.plotResults(potential, current, baselineCurrent, baselineSubtractedCurrent, peakIndices, peakCurrents, peakPotentials, axFull, dpvInd, fileName)
         
         # Save the analysis.
         saveExcelPath = dataDirectory + "DPV Analysis/Analysis Files/" + fileName + ".xlsx"
-        saveAnalysisResults.saveDataDPV(potential, current, baselineCurrent, baselineSubtractedCurrent, peakCurrents, peakPotentials, saveExcelPath)
+        saveAnalysisResults.saveDataDPV(potential, current, baselineCurrent, baselineSubtractedCurrent, peakCurrents, peakPotentials, saveExcelPath, baselineInfo, peakCharacteristics)
+        
+        # Return the data in case user wants.
+        return [potential, unfilteredCurrent, current, baselineCurrent, baselineSubtractedCurrent], [peakPotentials, peakCurrents]
+    
+    def saveCompiledAnalysis(analysisInfo, peakInfo, fileNames):
+        try:
+            # If they all share a common potential.
+            if all(np.array_equal(curveInfo[0], analysisInfo[0][0]) for curveInfo in analysisInfo):
+                # Make an ndarray out of the analysis information. Dim: numCurves, 5, numScanPoints
+                analysisInfo = np.array(analysisInfo, dtype=float)
+                # Plot the compiled analysis.
+                if len(peakInfo) < 30:
+                    plot.plotCompiledResults(analysisInfo, peakInfo, fileNames)
+    
+                # Save single excel document with all the information.
+                saveExcelPath = dataDirectory + "DPV Analysis/Analysis Files/compiledAnalysis.xlsx"
+                saveAnalysisResults.saveAllData(analysisInfo, peakInfo, saveExcelPath)
+        except:
+            pass
+    
+    # If all the curves share a potential, filter and find their baselines at once.
+    allBatchResults = [None]*len(curves)
+    if curves.isDense and (useLinearFit or useBaselineSubtraction) and len(curves) != 0:
+        # Apply a Low Pass Filter
+        allFilteredCurrents = dpvProtocols.filteringMethods.savgolFilter.savgolFilter(curves.current, 7, 3, axis=-1)
+        allBaselineInfo = [{} for _ in range(len(curves))]
+        # Perform Iterative Polynomial Subtraction
+        if useBaselineSubtraction:
+            allBaselines, allBaselineSubtracted, allPeakIndices = dpvProtocols.useBaselineSubtraction_Batch(allFilteredCurrents, curves.potential, polynomialOrder)
+            # Record the chosen polynomial order of each curve.
+            if polynomialOrder == "auto":
+                allBaselineInfo = [{"Polynomial Order": int(bestOrder), "Order Score": float(orderScore)} for bestOrder, orderScore in zip(dpvProtocols.polynomialBaselineFit.bestOrders, dpvProtocols.polynomialBaselineFit.orderScores)]
+        # Find Optimal Linear Baseline Under Each Peak
+        else:
+            allBaselines, allBaselineSubtracted, allPeakIndices = dpvProtocols.useLinearFit_Batch(allFilteredCurrents, curves.potential, curves.current)
+            # Record the peak screen and the baseline used for each curve.
+            allBaselineInfo = dpvProtocols.linearBaselineFit.allBaselineInfo
+        # Find the height, prominence, width, and area of each peak.
+        allIndCuts = dpvProtocols.allBaselineIndCuts if useLinearFit else None
+        allPeakCharacteristics = dpvProtocols.characterizePeaks(curves.potential, allFilteredCurrents, allBaselineSubtracted, allPeakIndices, allIndCuts)
+        allBatchResults = list(zip(allFilteredCurrents, allBaselines, allBaselineSubtracted, allPeakIndices, allBaselineInfo, allPeakCharacteristics))
+    
+    peakInfo = []
+    analysisInfo = []
+    # For each file we are analyzing.
+    for dpvInd in range(len(curves)):
+        # Extract all the DPV information from the trial (already scaled and culled).
+        peakPotentials, peakCurrents = allPeakPotentials[dpvInd], allPeakCurrents[dpvInd]    
+        potential, unfilteredCurrent = curves[dpvInd]
+        fileName = fileNames[dpvInd]
+        
+        # Analyze, plot, and save the curve.
+        curveAnalysis, curvePeaks = analyzeCurve(potential, unfilteredCurrent, peakPotentials, peakCurrents, fileName, ax, dpvInd, allBatchResults[dpvInd])
+        # Store the data in case user wants.
+        analysisInfo.append(curveAnalysis)
+        peakInfo.append(curvePeaks)
             
-# ---------------------------------------------------------------------------#
-# --------------------- Plot and Save the Data ------------------------------#
-
-# Assert the integrity of data analysis.
-assert len(peakInfo) == len(analysisInfo)
-
-# Plot and save all the analysis in one figure.
-plt.setp(ax, ylim=plot.finalYLim)
-plt.title("All Decompositions") # Need this Line as we Change the Title When we Save Subplots
-plot.saveSubplot(fig)
-plt.show() # Must be the Last Line
-
-try:
-    # Make an ndarray out of the analysis information.
-    analysisInfo = np.array(analysisInfo, dtype=object)
-    # If they all share a common potential.
-    if np.all(np.equal(analysisInfo[:,0], analysisInfo[:, 0][0])):
-        # Plot the compiled analysis.
-        if len(peakInfo) < 30:
-            plot.plotCompiledResults(analysisInfo, peakInfo, fileNames)
-
-        # Save single excel document with all the information.
-        saveExcelPath = dataDirectory + "DPV Analysis/Analysis Files/compiledAnalysis.xlsx"
-        saveAnalysisResults.saveAllData(analysisInfo, peakInfo, saveExcelPath)
-except:
-    pass
+    # ---------------------------------------------------------------------------#
+    # --------------------- Plot and Save the Data ------------------------------#
 
+    # Assert the integrity of data analysis.
+    assert len(peakInfo) == len(analysisInfo)
 
+    # Plot and save all the analysis in one figure.
+    plt.setp(ax, ylim=plot.finalYLim)
+    plt.title("All Decompositions") # Need this Line as we Change the Title When we Save Subplots
+    plot.saveSubplot(fig)
+    # Save the compiled analysis.
+    saveCompiledAnalysis(analysisInfo, peakInfo, fileNames)
+    
+    # ---------------------------------------------------------------------------#
+    # ----------------------- Watch for New Files -------------------------------#
+    
+    if watchFolder:
+        plt.close('all')
+        print("\nWatching for new files in:", dataDirectory)
+        lastCompiledSave = time.time(); compiledSavePending = False
+        try:
+            # Each time new files finish writing to the folder (idle polls let the timed save run).
+            for newFiles in extractData.watchFiles(dataDirectory, removeFilesContaining, analyzeFilesContaining, analysisFiles, pollInterval, readBinaryFiles = readBinaryFiles, yieldIdlePolls = True):
+                for analysisFile in newFiles:
+                    startTime = time.time()
+                    # Read in only the new file.
+                    newPotential, newCurrent, newPeakPotentials, newPeakCurrents, newFileNames = extractData.getAllData([analysisFile], dataDirectory, testSheetNum = 0, excelDelimiter = ",", saveXL = saveXL, useCache = useCache, numWorkers = 1)
+                    newCurves = excelProcessing.curveBatch(newPotential, newCurrent, extractData.curveInfo)
+                    newCurves.scaleCurrent(scaleCurrent)
+                    newCurves.applyPotentialBounds(potentialBounds)
+                
+                    for curveInd in range(len(newCurves)):
+                        potential, unfilteredCurrent = newCurves[curveInd]
+                        fileName = newFileNames[curveInd]
+                        # Analyze the curve (new curves are not added to the subplots).
+                        curveAnalysis, curvePeaks = analyzeCurve(potential, unfilteredCurrent, newPeakPotentials[curveInd], newPeakCurrents[curveInd], fileName, None, curveInd)
+                    
+                        # Replace the results of a modified file, or append the new results.
+                        if fileName in fileNames:
+                            fileInd = fileNames.index(fileName)
+                            analysisInfo[fileInd] = curveAnalysis; peakInfo[fileInd] = curvePeaks
+                        else:
+                            fileNames.append(fileName)
+                            analysisInfo.append(curveAnalysis); peakInfo.append(curvePeaks)
+                        plt.close('all')
+                
+                    compiledSavePending = True
+                
+                    # Report how long the file took to analyze and how long after it was written.
+                    analysisTime = time.time() - startTime
+                    fileLatency = time.time() - os.path.getmtime(analysisFile) if os.path.exists(analysisFile) else analysisTime
+                    print(f"\nFinished {os.path.basename(analysisFile)}: Analysis Time = {analysisTime:.2f} s; Latency = {fileLatency:.2f} s")
+                
+                # Rewriting the compiled analysis scales with the session: batch the new results on a timer.
+                if compiledSavePending and compiledSaveInterval <= time.time() - lastCompiledSave:
+                    saveCompiledAnalysis(analysisInfo, peakInfo, fileNames)
+                    lastCompiledSave = time.time(); compiledSavePending = False
+        finally:
+            # Save any results still waiting on the timer (e.g. when the watch is stopped).
+            if compiledSavePending:
+                saveCompiledAnalysis(analysisInfo, peakInfo, fileNames)
+    else:
+        plt.show() # Must be the Last Line
@@ -0,0 +1,81 @@
+# -------------------------------------------------------------------------- #
+# ---------------------------- Imported Modules ---------------------------- #
+
+# General
+import os
+import sys
+import time
+import unittest
+import tracemalloc
+import numpy as np
+
+# Import analysis files
+sys.path.append(os.path.dirname(__file__) + "/../Helper Files/")
+sys.path.append(os.path.dirname(__file__) + "/../Helper Files/Biolectric Protocols/")
+import _baselineProtocols
+
+# -------------------------------------------------------------------------- #
+# ------------------------- Tangent Line Searches -------------------------- #
+
+class testTangentSearch(unittest.TestCase):
+
+    def getCurve(self, numPoints, peakPotential = -0.3, peakWidth = 0.05, slope = 0.5, noise = 0.05, seed = 0):
+        # A noisy gaussian peak on a sloped background.
+        potential = np.linspace(-0.6, 0, numPoints)
+        current = np.exp(-((potential - peakPotential)/peakWidth)**2) + slope*potential
+        current += noise*np.random.default_rng(seed).standard_normal(numPoints)
+        return potential, current
+
+    def getLinearFit(self, potential, tangentSearch, maxScoringMemory = 64*1024**2):
+        linearFit = _baselineProtocols.bestLinearFit2(tangentSearch = tangentSearch, maxScoringMemory = maxScoringMemory)
+        linearFit.setSamplingFreq(potential)
+        return linearFit
+
+    def getPeakMemory(self, linearFit, potential, current, peakInd, timeLimit = 1):
+        # Stop the search early: the memory is set by the first blocks.
+        linearFit.deadline = time.time() + timeLimit; linearFit.outOfTime = False
+        tracemalloc.start()
+        try:
+            linearFit.findLinearBaseline(potential, current, peakInd)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_searchesMatchLoops(self):
+        for seed in range(3):
+            potential, current = self.getCurve(200, noise = 0.02, seed = seed)
+            peakInd = int(current[20:-20].argmax()) + 20
+            loopPair = self.getLinearFit(potential, "loops").findLinearBaseline(potential, current, peakInd)
+
+            # The blocks (down to one pair at a time) and the hull choose the same line as the loops.
+            for tangentSearch, maxScoringMemory in [("vectorized", 64*1024**2), ("vectorized", 1), ("hull", 64*1024**2), ("hull", 1)]:
+                linearFit = self.getLinearFit(potential, tangentSearch, maxScoringMemory)
+                self.assertEqual(linearFit.findLinearBaseline(potential, current, peakInd), loopPair)
+
+    def test_rankedMatchesLoops(self):
+        # Noisy peaks near the edge: every line has points below it, so the hull uses the ranked search.
+        for noise, seed in [(0.05, 4), (0.05, 7), (0.2, 0)]:
+            potential, current = self.getCurve(300, peakPotential = -0.55, peakWidth = 0.03, slope = 0.3, noise = noise, seed = seed)
+            peakInd = int(current[5:-5].argmax()) + 5
+            loopPair = self.getLinearFit(potential, "loops").findLinearBaseline(potential, current, peakInd)
+
+            for maxScoringMemory in [64*1024**2, 1]:
+                linearFit = self.getLinearFit(potential, "hull", maxScoringMemory)
+                self.assertEqual(linearFit.findLinearBaseline_Hull(potential, current, peakInd), loopPair)
+                self.assertEqual(linearFit.findLinearBaseline_Ranked(potential, current, peakInd), loopPair)
+
+    def test_vectorizedMemoryCeiling(self):
+        maxScoringMemory = 16*1024**2
+        for numPoints in [2000, 6000]:
+            potential, current = self.getCurve(numPoints)
+            linearFit = self.getLinearFit(potential, "vectorized", maxScoringMemory)
+            self.assertLess(self.getPeakMemory(linearFit, potential, current, numPoints//2), maxScoringMemory)
+
+    def test_rankedMemoryCeiling(self):
+        maxScoringMemory = 16*1024**2
+        potential, current = self.getCurve(3000, peakPotential = -0.55, peakWidth = 0.03, slope = 0.3, noise = 0.1, seed = 4)
+        linearFit = self.getLinearFit(potential, "hull", maxScoringMemory)
+        self.assertLess(self.getPeakMemory(linearFit, potential, current, int(current[5:-5].argmax()) + 5, timeLimit = 5), maxScoringMemory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+# -------------------------------------------------------------------------- #
+# ---------------------------- Imported Modules ---------------------------- #
+
+# General
+import os
+import sys
+import unittest
+import numpy as np
+
+# Import analysis files
+sys.path.append(os.path.dirname(__file__) + "/../Helper Files/")
+sys.path.append(os.path.dirname(__file__) + "/../Helper Files/Biolectric Protocols/")
+import dpvAnalysis
+
+# -------------------------------------------------------------------------- #
+# ------------------------- Peak Characterization -------------------------- #
+
+class testCharacterizePeaks(unittest.TestCase):
+    
+    def setUp(self):
+        # Two overlapping gaussian peaks on a flat (baseline subtracted) current.
+        self.potential = np.linspace(-0.5, 0, 501)
+        self.peakWidth = 0.03
+        self.bigPeak = np.exp(-((self.potential + 0.25)/self.peakWidth)**2)
+        self.smallPeak = 0.3*np.exp(-((self.potential + 0.15)/self.peakWidth)**2)
+        self.current = self.bigPeak + self.smallPeak
+        self.peakIndices = np.array([self.current[:300].argmax(), 300 + self.current[300:].argmax()])
+        
+        self.dpvProtocols = dpvAnalysis.dpvProtocols()
+    
+    def getArea(self, current):
+        return np.trapezoid(current, self.potential)
+    
+    def test_overlappingPeaks(self):
+        peakCharacteristics = self.dpvProtocols.characterizePeaks(self.potential, [self.current], [self.current], [self.peakIndices])[0]
+        
+        # The peaks are in order, at their maximum.
+        np.testing.assert_array_equal(peakCharacteristics["index"], self.peakIndices)
+        np.testing.assert_allclose(peakCharacteristics["height"], self.current[self.peakIndices])
+        # The big peak does not absorb the small peak: the area is split between them.
+        self.assertAlmostEqual(peakCharacteristics["area"].sum(), self.getArea(self.current), places=3)
+        np.testing.assert_allclose(peakCharacteristics["area"], [self.getArea(self.bigPeak), self.getArea(self.smallPeak)], rtol=0.05)
+        # The width of the big peak is the FWHM of its gaussian.
+        self.assertAlmostEqual(peakCharacteristics["fwhm"][0], 2*np.sqrt(np.log(2))*self.peakWidth, places=3)
+    
+    def test_sharedBaselineSegment(self):
+        # Both peaks sit under one linear baseline segment.
+        allIndCuts = [[0, 0, len(self.potential) - 1, len(self.potential)]]
+        peakCharacteristics = self.dpvProtocols.characterizePeaks(self.potential, [self.current], [self.current], [self.peakIndices], allIndCuts)[0]
+        
+        # The segment is split at the valley, so its area is only counted once.
+        self.assertAlmostEqual(peakCharacteristics["area"].sum(), self.getArea(self.current), places=6)
+    
+    def test_batchedCurves(self):
+        # Reductive curves and curves without peaks are characterized along with the others.
+        currents = np.array([self.current, -self.current, np.zeros_like(self.current)])
+        allPeakCharacteristics = self.dpvProtocols.characterizePeaks(self.potential, currents, currents, [self.peakIndices, self.peakIndices, []])
+        
+        self.assertEqual([len(peakCharacteristics) for peakCharacteristics in allPeakCharacteristics], [2, 2, 0])
+        for fieldName in ["prominence", "fwhm"]:
+            np.testing.assert_allclose(allPeakCharacteristics[1][fieldName], allPeakCharacteristics[0][fieldName])
+        np.testing.assert_allclose(allPeakCharacteristics[1]["area"], -allPeakCharacteristics[0]["area"])
+
+if __name__ == "__main__":
+    unittest.main()